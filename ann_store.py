@@ -0,0 +1,464 @@
+import json
+import logging
+import math
+import os
+import pathlib
+import sqlite3
+import threading
+import time
+import uuid
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+
+# In-process ANN vector store, an alternative to the in-memory Chroma backend.
+# - Vectors are L2-normalised and stored as float16 (or int8) rows in a
+#   memory-mapped file, so they live in the page cache instead of the Python heap.
+# - Once the corpus is large enough, a FAISS IVF index with 8-bit scalar
+#   quantisation is built over the stored rows and loaded memory-mapped.
+# - Rows added after the last index build form a small "delta" that is searched
+#   exactly; deletes are tombstones filtered at query time. compact() rebuilds
+#   the index over all live rows, first rewriting the vector file without
+#   tombstoned rows once they make up a large share of it.
+# - Texts and metadata are kept in SQLite next to the vectors.
+# FAISS (faiss-cpu, listed in Pipfile) is needed for the ANN index; without it
+# the store still works but searches exactly, and warns on startup.
+
+try:
+    import faiss
+except ImportError:
+    faiss = None
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS docs (
+    doc_id TEXT PRIMARY KEY,
+    row INTEGER UNIQUE NOT NULL,
+    text TEXT NOT NULL,
+    metadata TEXT,
+    created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_docs_created ON docs (created);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+STORAGE_SCALE = {"float16": 1.0, "int8": 127.0}
+
+
+class VectorFile:
+    def __init__(self, path, dim, dtype="float16"):
+        self.path = pathlib.Path(path)
+        self.dim = dim
+        self.dtype = np.dtype(dtype)
+        self.scale = STORAGE_SCALE[dtype]
+        row_bytes = dim * self.dtype.itemsize
+        size = self.path.stat().st_size if self.path.exists() else 0
+        self.capacity = max(size // row_bytes, 1024)
+        self._open()
+
+    def _open(self):
+        nbytes = self.capacity * self.dim * self.dtype.itemsize
+        with open(self.path, "ab") as f:
+            if f.tell() < nbytes:
+                f.truncate(nbytes)
+        self.data = np.memmap(self.path, dtype=self.dtype, mode="r+",
+                              shape=(self.capacity, self.dim))
+
+    def ensure(self, rows):
+        if rows <= self.capacity:
+            return
+        self.data.flush()
+        del self.data
+        self.capacity = max(rows, self.capacity * 2)
+        self._open()
+
+    def write(self, start, vectors):
+        self.ensure(start + len(vectors))
+        if self.scale != 1.0:
+            vectors = np.clip(np.rint(vectors * self.scale), -127, 127)
+        self.data[start:start + len(vectors)] = vectors.astype(self.dtype)
+
+    def read(self, start, stop):
+        return np.asarray(self.data[start:stop], dtype=np.float32) / self.scale
+
+    def flush(self):
+        self.data.flush()
+
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if vectors.ndim == 1:
+        vectors = vectors[None, :]
+    return vectors / (np.linalg.norm(vectors, axis=1, keepdims=True) + 1e-12)
+
+
+class AnnVectorStore(VectorStore):
+    def __init__(self, directory, embedding, storage_dtype="float16", nprobe=16,
+                 min_index_rows=20000, search_chunk=65536, reclaim_ratio=0.2):
+        self.directory = pathlib.Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._embedding = embedding
+        self.storage_dtype = storage_dtype
+        self.nprobe = nprobe
+        self.min_index_rows = min_index_rows
+        self.search_chunk = search_chunk
+        self.reclaim_ratio = reclaim_ratio
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(
+            str(self.directory / "docs.db"), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(SCHEMA)
+        self._db.commit()
+        self.dim = int(self._meta("dim", 0))
+        self.count = int(self._meta("count", 0))
+        self.generation = int(self._meta("generation", 0))
+        self._sealed = int(self._meta("sealed", 0))
+        self._vectors = None
+        self._index = None
+        self._alive = np.zeros(max(self.count, 1024), dtype=bool)
+        for (row,) in self._db.execute("SELECT row FROM docs"):
+            self._alive[row] = True
+        if self.dim:
+            self._open_vectors()
+            self._load_index()
+        if faiss is None:
+            logging.warning(
+                "faiss-cpu is not installed: the ANN vector store falls back to exact "
+                "brute-force search (pip install faiss-cpu)")
+
+    @property
+    def embeddings(self):
+        return self._embedding
+
+    def _meta(self, key, default=None):
+        row = self._db.execute(
+            "SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def _set_meta(self, **values):
+        self._db.executemany(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+            [(key, str(value)) for key, value in values.items()])
+
+    def _vector_path(self):
+        return self.directory / self._meta("vectors_file", f"vectors.{self.storage_dtype}")
+
+    def _open_vectors(self):
+        self._vectors = VectorFile(
+            self._vector_path(), self.dim, self.storage_dtype)
+
+    def _index_path(self, generation):
+        return self.directory / f"index.{generation}.faiss"
+
+    def _load_index(self):
+        path = self._index_path(self.generation)
+        if faiss is None or not self._sealed or not path.exists():
+            self._index = None
+            self._sealed = 0
+            return
+        # Memory-map the inverted lists instead of reading them into RAM
+        self._index = faiss.read_index(str(path), faiss.IO_FLAG_MMAP)
+        self._index.nprobe = self.nprobe
+
+    def _grow_alive(self, rows):
+        if rows > len(self._alive):
+            alive = np.zeros(max(rows, len(self._alive) * 2), dtype=bool)
+            alive[:len(self._alive)] = self._alive
+            self._alive = alive
+
+    # Add precomputed embeddings; existing ids are replaced. `created` (epoch
+    # seconds per text, default now) is the age used by expire()
+    def add_embeddings(self, texts, vectors, metadatas=None, ids=None, created=None):
+        texts = list(texts)
+        if not texts:
+            return []
+        vectors = _normalize(vectors)
+        ids = list(ids) if ids else [str(uuid.uuid4()) for _ in texts]
+        metadatas = list(metadatas) if metadatas else [{} for _ in texts]
+        with self._lock:
+            if not self.dim:
+                self.dim = vectors.shape[1]
+                self._open_vectors()
+                self._set_meta(dim=self.dim)
+            self._delete_locked(ids)
+            start = self.count
+            self._vectors.write(start, vectors)
+            self._vectors.flush()
+            created = list(created) if created else [time.time()] * len(texts)
+            with self._db:
+                self._db.executemany(
+                    "INSERT INTO docs (doc_id, row, text, metadata, created) VALUES (?, ?, ?, ?, ?)",
+                    [(doc_id, start + i, text, json.dumps(metadata or {}, ensure_ascii=False), ts)
+                     for i, (doc_id, text, metadata, ts) in enumerate(zip(ids, texts, metadatas, created))])
+                self.count = start + len(texts)
+                self._set_meta(count=self.count)
+            self._grow_alive(self.count)
+            self._alive[start:self.count] = True
+        return ids
+
+    def add_texts(self, texts, metadatas=None, ids=None, **kwargs):
+        texts = list(texts)
+        if not texts:
+            return []
+        vectors = self._embedding.embed_documents(texts)
+        return self.add_embeddings(texts, vectors, metadatas=metadatas, ids=ids,
+                                   created=kwargs.get("created"))
+
+    def _delete_locked(self, ids):
+        rows = []
+        for chunk_start in range(0, len(ids), 500):
+            chunk = ids[chunk_start:chunk_start + 500]
+            rows.extend(row for (row,) in self._db.execute(
+                f"SELECT row FROM docs WHERE doc_id IN ({','.join('?' * len(chunk))})", chunk))
+        if not rows:
+            return 0
+        with self._db:
+            self._db.executemany(
+                "DELETE FROM docs WHERE row = ?", [(row,) for row in rows])
+        self._alive[rows] = False
+        return len(rows)
+
+    def delete(self, ids=None, **kwargs):
+        if not ids:
+            return False
+        with self._lock:
+            return self._delete_locked(list(ids)) > 0
+
+    def has_ids(self, ids):
+        ids = list(ids)
+        found = set()
+        with self._lock:
+            for chunk_start in range(0, len(ids), 500):
+                chunk = ids[chunk_start:chunk_start + 500]
+                found.update(doc_id for (doc_id,) in self._db.execute(
+                    f"SELECT doc_id FROM docs WHERE doc_id IN ({','.join('?' * len(chunk))})", chunk))
+        return found
+
+    # Delete documents created before `before` (epoch seconds), then the oldest
+    # ones beyond `max_rows`. Returns the number of documents removed.
+    def expire(self, before=None, max_rows=None):
+        removed = 0
+        with self._lock:
+            if before:
+                expired = [doc_id for (doc_id,) in self._db.execute(
+                    "SELECT doc_id FROM docs WHERE created < ?", (before,))]
+                removed += self._delete_locked(expired)
+            if max_rows:
+                excess = len(self) - max_rows
+                if excess > 0:
+                    oldest = [doc_id for (doc_id,) in self._db.execute(
+                        "SELECT doc_id FROM docs ORDER BY created, row LIMIT ?", (excess,))]
+                    removed += self._delete_locked(oldest)
+        return removed
+
+    # Named progress markers for callers that feed the store incrementally
+    def checkpoint(self, name, default=None):
+        with self._lock:
+            return self._meta(f"checkpoint:{name}", default)
+
+    def set_checkpoint(self, name, value):
+        with self._lock, self._db:
+            self._set_meta(**{f"checkpoint:{name}": value})
+
+    def tombstones(self):
+        return int(self.count - self._alive[:self.count].sum())
+
+    def __len__(self):
+        return int(self._alive[:self.count].sum())
+
+    def _exact_search(self, query, start, stop, k):
+        best_rows = np.empty(0, dtype=np.int64)
+        best_scores = np.empty(0, dtype=np.float32)
+        for chunk_start in range(start, stop, self.search_chunk):
+            chunk_stop = min(chunk_start + self.search_chunk, stop)
+            scores = self._vectors.read(chunk_start, chunk_stop) @ query
+            scores[~self._alive[chunk_start:chunk_stop]] = -np.inf
+            take = min(k, len(scores))
+            top = np.argpartition(-scores, take - 1)[:take]
+            best_rows = np.concatenate(
+                [best_rows, top.astype(np.int64) + chunk_start])
+            best_scores = np.concatenate([best_scores, scores[top]])
+        return best_rows, best_scores
+
+    def _index_search(self, query, k):
+        # Over-fetch so tombstoned rows can be dropped and still leave k hits
+        fetch = k
+        while True:
+            scores, rows = self._index.search(query[None, :], fetch)
+            rows, scores = rows[0], scores[0]
+            keep = (rows >= 0)
+            keep[keep] = self._alive[rows[keep]]
+            if keep.sum() >= k or fetch >= self._sealed:
+                return rows[keep].astype(np.int64), scores[keep]
+            fetch = min(fetch * 4, self._sealed)
+
+    def similarity_search_by_vector_with_score(self, embedding, k=4):
+        query = _normalize(embedding)[0]
+        with self._lock:
+            if not self.count:
+                return []
+            if self._index is not None:
+                rows, scores = self._index_search(query, k)
+                delta_rows, delta_scores = self._exact_search(
+                    query, self._sealed, self.count, k)
+                rows = np.concatenate([rows, delta_rows])
+                scores = np.concatenate([scores, delta_scores])
+            else:
+                rows, scores = self._exact_search(query, 0, self.count, k)
+            order = np.argsort(-scores)
+            hits = [(int(rows[i]), float(scores[i]))
+                    for i in order if np.isfinite(scores[i])][:k]
+            docs = {}
+            if hits:
+                placeholders = ",".join("?" * len(hits))
+                for row, doc_id, text, metadata in self._db.execute(
+                        f"SELECT row, doc_id, text, metadata FROM docs WHERE row IN ({placeholders})",
+                        [row for row, _ in hits]):
+                    docs[row] = Document(
+                        id=doc_id, page_content=text, metadata=json.loads(metadata or "{}"))
+        return [(docs[row], score) for row, score in hits if row in docs]
+
+    def similarity_search_by_vector(self, embedding, k=4, **kwargs):
+        return [doc for doc, _ in self.similarity_search_by_vector_with_score(embedding, k)]
+
+    def similarity_search_with_score(self, query, k=4, **kwargs):
+        return self.similarity_search_by_vector_with_score(
+            self._embedding.embed_query(query), k)
+
+    def similarity_search(self, query, k=4, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score(query, k)]
+
+    def _select_relevance_score_fn(self):
+        # Cosine similarity in [-1, 1] -> relevance in [0, 1]
+        return lambda score: (score + 1.0) / 2.0
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, ids=None, directory=None, **kwargs):
+        store = cls(directory or "./ann_store", embedding, **kwargs)
+        store.add_texts(texts, metadatas=metadatas, ids=ids)
+        return store
+
+    # Rows added since the last index build
+    def delta_rows(self):
+        return self.count - self._sealed
+
+    def needs_reclaim(self):
+        return self.count > 0 and self.tombstones() / self.count >= self.reclaim_ratio
+
+    def needs_compaction(self):
+        if self.needs_reclaim():
+            return True
+        if faiss is None:
+            return False
+        if self._index is None:
+            return len(self) >= self.min_index_rows
+        return self.delta_rows() > max(self.min_index_rows // 2, self._sealed // 10)
+
+    # Copy live rows into a new vector file and renumber them, dropping
+    # tombstones. Runs under the lock; the new file only becomes current when
+    # the row renumbering commits, so a crash leaves the old file in use.
+    def _reclaim(self):
+        with self._lock:
+            live_rows = np.nonzero(self._alive[:self.count])[0]
+            old_path = self._vector_path()
+            new_name = f"vectors.{self.generation}.{int(time.time())}.{self.storage_dtype}"
+            new_vectors = VectorFile(
+                self.directory / new_name, self.dim, self.storage_dtype)
+            new_vectors.ensure(max(len(live_rows), 1))
+            for chunk_start in range(0, len(live_rows), self.search_chunk):
+                rows = live_rows[chunk_start:chunk_start + self.search_chunk]
+                new_vectors.data[chunk_start:chunk_start + len(rows)] = self._vectors.data[rows]
+            new_vectors.flush()
+            # Rows only move down, so renumbering in ascending order never collides
+            with self._db:
+                self._db.executemany(
+                    "UPDATE docs SET row = ? WHERE row = ?",
+                    [(new_row, int(old_row)) for new_row, old_row in enumerate(live_rows)
+                     if new_row != old_row])
+                self._set_meta(vectors_file=new_name,
+                               count=len(live_rows), sealed=0)
+            reclaimed = self.count - len(live_rows)
+            self._vectors = new_vectors
+            self.count = len(live_rows)
+            self._alive = np.zeros(max(self.count, 1024), dtype=bool)
+            self._alive[:self.count] = True
+            # The index refers to the old row numbers
+            self._index = None
+            self._sealed = 0
+        for path in (old_path, self._index_path(self.generation)):
+            if path == self._vector_path():
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        logging.info(f"ANN store reclaimed {reclaimed} deleted rows")
+        return reclaimed
+
+    # Reclaim tombstoned rows if needed, then rebuild the IVF index over all
+    # live rows. The index build runs outside the lock on a snapshot; rows
+    # added meanwhile stay in the delta.
+    def compact(self):
+        if self.needs_reclaim():
+            self._reclaim()
+        if faiss is None:
+            return False
+        with self._lock:
+            snapshot = self.count
+            live_rows = np.nonzero(self._alive[:snapshot])[0]
+        if len(live_rows) < self.min_index_rows:
+            return False
+        # ~4*sqrt(n) lists, with enough rows per list to train the centroids
+        nlist = int(min(4 * math.sqrt(len(live_rows)),
+                    len(live_rows) // 40, 65536))
+        nlist = max(nlist, 1)
+        sample_rows = np.sort(np.random.default_rng(0).choice(
+            live_rows, size=min(len(live_rows), nlist * 64), replace=False))
+        quantizer = faiss.IndexFlatIP(self.dim)
+        index = faiss.IndexIVFScalarQuantizer(
+            quantizer, self.dim, nlist, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_INNER_PRODUCT)
+        index.train(np.ascontiguousarray(
+            self._vectors.data[sample_rows], dtype=np.float32) / self._vectors.scale)
+        for chunk_start in range(0, len(live_rows), self.search_chunk):
+            rows = live_rows[chunk_start:chunk_start + self.search_chunk]
+            index.add_with_ids(
+                np.ascontiguousarray(
+                    self._vectors.data[rows], dtype=np.float32) / self._vectors.scale,
+                rows.astype(np.int64))
+        generation = self.generation + 1
+        faiss.write_index(index, str(self._index_path(generation)))
+        del index, quantizer
+        with self._lock:
+            old_generation = self.generation
+            with self._db:
+                self._set_meta(generation=generation, sealed=snapshot)
+            self.generation = generation
+            self._sealed = snapshot
+            self._load_index()
+        try:
+            os.remove(self._index_path(old_generation))
+        except FileNotFoundError:
+            pass
+        logging.info(
+            f"ANN index rebuilt over {len(live_rows)} rows (nlist={nlist})")
+        return True
+
+    def stats(self):
+        with self._lock:
+            return {
+                "rows": len(self),
+                "tombstones": self.tombstones(),
+                "indexed_rows": self._sealed,
+                "delta_rows": self.delta_rows(),
+                "index": "ivf-sq8" if self._index is not None else "exact",
+                "storage": self.storage_dtype,
+            }
+
+    def close(self):
+        with self._lock:
+            if self._vectors is not None:
+                self._vectors.flush()
+            self._db.close()
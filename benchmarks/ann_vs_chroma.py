@@ -0,0 +1,165 @@
+import argparse
+import json
+import pathlib
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+# Benchmark: AnnVectorStore vs in-memory Chroma
+# Measures recall@k against exact search, query latency (p50/p95) and the
+# resident memory of the process after loading N rows. Each backend runs in
+# its own subprocess so memory numbers do not mix.
+#
+#   python benchmarks/ann_vs_chroma.py --rows 100000 1000000
+#   python benchmarks/ann_vs_chroma.py --rows 100000 --backends ann
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+DIM = 384  # sentence-transformers/all-MiniLM-L6-v2
+
+
+def rss_mb():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # Peak RSS (KiB on Linux, bytes on macOS)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+# Clustered unit vectors, closer to sentence embeddings than uniform noise
+def make_data(rows, queries, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((max(rows // 500, 16), DIM)).astype(np.float32)
+    labels = rng.integers(0, len(centers), rows)
+    data = centers[labels] + 0.5 * \
+        rng.standard_normal((rows, DIM)).astype(np.float32)
+    data /= np.linalg.norm(data, axis=1, keepdims=True)
+    picks = rng.integers(0, rows, queries)
+    query = data[picks] + 0.1 * \
+        rng.standard_normal((queries, DIM)).astype(np.float32)
+    query /= np.linalg.norm(query, axis=1, keepdims=True)
+    return data, query
+
+
+def ground_truth(data, query, k):
+    truth = []
+    for q in query:
+        scores = data @ q
+        truth.append(set(np.argpartition(-scores, k)[:k].tolist()))
+    return truth
+
+
+# The stores are filled and queried with precomputed vectors only
+class NoEmbeddings:
+    def embed_documents(self, texts):
+        raise RuntimeError("benchmark inserts precomputed vectors only")
+
+    def embed_query(self, text):
+        raise RuntimeError("benchmark queries with precomputed vectors only")
+
+
+def load_ann(data, directory, storage_dtype):
+    from ann_store import AnnVectorStore
+    store = AnnVectorStore(directory, NoEmbeddings(),
+                           storage_dtype=storage_dtype)
+    for start in range(0, len(data), 50000):
+        chunk = data[start:start + 50000]
+        store.add_embeddings([str(start + i) for i in range(len(chunk))], chunk,
+                             ids=[str(start + i) for i in range(len(chunk))])
+    store.compact()
+    return lambda q, k: [int(doc.page_content) for doc in store.similarity_search_by_vector(q, k)]
+
+
+def load_chroma(data, directory, storage_dtype):
+    from langchain_community.vectorstores import Chroma
+    store = Chroma(collection_name="bench", embedding_function=NoEmbeddings(),
+                   collection_metadata={"hnsw:space": "cosine"})
+    # Chroma limits the batch size per add call
+    for start in range(0, len(data), 5000):
+        chunk = data[start:start + 5000]
+        ids = [str(start + i) for i in range(len(chunk))]
+        store._collection.add(ids=ids, embeddings=chunk.tolist(), documents=ids)
+    return lambda q, k: [int(doc.page_content) for doc in store.similarity_search_by_vector(q.tolist(), k)]
+
+
+def run_backend(backend, rows, queries, k, storage_dtype):
+    data, query = make_data(rows, queries)
+    truth = ground_truth(data, query, k)
+    base_rss = rss_mb()
+    with tempfile.TemporaryDirectory() as directory:
+        started = time.perf_counter()
+        search = (load_ann if backend == "ann" else load_chroma)(
+            data, directory, storage_dtype)
+        load_seconds = time.perf_counter() - started
+        # Free the generator's copy so RSS reflects the store only
+        del data
+        latencies, hits = [], 0
+        for q, expected in zip(query, truth):
+            started = time.perf_counter()
+            found = search(q, k)
+            latencies.append((time.perf_counter() - started) * 1000)
+            hits += len(expected.intersection(found))
+        return {
+            "backend": backend if backend == "chroma" else f"ann-{storage_dtype}",
+            "rows": rows,
+            f"recall@{k}": round(hits / (k * len(truth)), 4),
+            "p50_ms": round(float(np.percentile(latencies, 50)), 2),
+            "p95_ms": round(float(np.percentile(latencies, 95)), 2),
+            "load_s": round(load_seconds, 1),
+            "rss_mb": round(rss_mb() - base_rss, 1),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="AnnVectorStore vs Chroma: recall, latency, memory")
+    parser.add_argument("--rows", type=int, nargs="+", default=[100000])
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("-k", type=int, default=4)
+    parser.add_argument("--backends", nargs="+",
+                        default=["chroma", "ann"], choices=["chroma", "ann"])
+    parser.add_argument("--storage", default="float16",
+                        choices=["float16", "int8"])
+    parser.add_argument("--single", action="store_true",
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single:
+        result = run_backend(args.backends[0], args.rows[0], args.queries,
+                             args.k, args.storage)
+        print(json.dumps(result))
+        return
+
+    results = []
+    for rows in args.rows:
+        for backend in args.backends:
+            output = subprocess.run(
+                [sys.executable, __file__, "--single", "--rows", str(rows),
+                 "--queries", str(args.queries), "-k", str(args.k),
+                 "--backends", backend, "--storage", args.storage],
+                capture_output=True, text=True)
+            if output.returncode != 0:
+                print(f"{backend} @ {rows} failed:\n{output.stderr}", file=sys.stderr)
+                continue
+            results.append(json.loads(output.stdout.strip().splitlines()[-1]))
+            print(json.dumps(results[-1]))
+
+    if results:
+        columns = list(results[0])
+        print()
+        print(" | ".join(columns))
+        for result in results:
+            print(" | ".join(str(result[column]) for column in columns))
+
+
+if __name__ == "__main__":
+    main()
@@ -2,9 +2,8 @@ import asyncio
 import logging
 import os
 import tempfile  # For temporary files
+import time
 import pathlib   # For path operations
-import csv
-from datetime import datetime
 
 from dotenv import load_dotenv
 
@@ -13,27 +12,111 @@ from aiogram.filters import CommandStart, Command
 from aiogram.types import Message, Voice, PhotoSize, Document, Video, Audio, Sticker, Contact, Location
 from aiogram.enums import ParseMode, ChatAction
 from aiogram.client.default import DefaultBotProperties
+from aiogram.exceptions import TelegramNetworkError, TelegramRetryAfter
+import aiohttp
 
 # For language model API
-import google.generativeai as genai
+from google.api_core import exceptions as api_exceptions
 from google.generativeai.types import generation_types
 
 # For RAG
-from langchain_community.document_loaders import CSVLoader
 from langchain_community.vectorstores import Chroma
 from langchain_community.embeddings import HuggingFaceEmbeddings
 from langchain.chains import RetrievalQA
 from langchain_community.llms import HuggingFaceHub
 
+from conversation_store import ConversationStore
+from ann_store import AnnVectorStore
+from vector_maintenance import VectorMaintainer
+from intent_router import IntentRouter
+from single_flight import SingleFlight, normalize_query
+from outbound import OutboundSender
+from model_pool import ModelPool, is_throttle_error
+from prompt_budget import PromptBudget, BudgetedRetriever, PromptCapture, estimate_tokens
+from http_pool import PooledAiohttpSession, SdkExecutor, configure_hf_http
+from job_queue import JobQueue, JobFailed, PRIORITY_INTERACTIVE, PRIORITY_MEDIA, PRIORITY_BULK
+
 # Load environment variables from .env file
 load_dotenv()
 
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 MODEL_NAME = os.getenv("MODEL_NAME")
+# Gemini key/model pool: several keys may be given comma separated
+GEMINI_API_KEYS = [key.strip() for key in os.getenv(
+    "GEMINI_API_KEYS", GEMINI_API_KEY or "").split(",") if key.strip()]
+GEMINI_FAST_MODEL = os.getenv("GEMINI_FAST_MODEL", MODEL_NAME)
+GEMINI_STRONG_MODEL = os.getenv("GEMINI_STRONG_MODEL", MODEL_NAME)
+# Requests per minute allowed per key/model (0 = no local limit)
+GEMINI_KEY_RPM = int(os.getenv("GEMINI_KEY_RPM", "0"))
+GEMINI_THROTTLE_COOLDOWN = int(os.getenv("GEMINI_THROTTLE_COOLDOWN", "60"))
+# Media at least this large goes to the strong model
+STRONG_MODEL_MIN_MB = float(os.getenv("STRONG_MODEL_MIN_MB", "2"))
+# Token budgets for free text sent to the models (user question, captions,
+# transcription); longer text is compressed, then shortened. The text budget
+# covers the question and the retrieved RAG context together.
+TEXT_TOKEN_BUDGET = int(os.getenv("TEXT_TOKEN_BUDGET", "1000"))
+IMAGE_CAPTION_TOKEN_BUDGET = int(os.getenv("IMAGE_CAPTION_TOKEN_BUDGET", "500"))
+DOCUMENT_CAPTION_TOKEN_BUDGET = int(
+    os.getenv("DOCUMENT_CAPTION_TOKEN_BUDGET", "1000"))
+VOICE_TOKEN_BUDGET = int(os.getenv("VOICE_TOKEN_BUDGET", "2000"))
+# System prompts at least this long are uploaded as Gemini cached content
+PROMPT_CACHE_MIN_TOKENS = int(os.getenv("PROMPT_CACHE_MIN_TOKENS", "1024"))
+PROMPT_CACHE_TTL = int(os.getenv("PROMPT_CACHE_TTL", "3600"))
 HUGGING_FACE_API_KEY = os.getenv("HUGGING_FACE_API_KEY")
 HUGGING_FACE_MODEL = os.getenv("HUGGING_FACE_MODEL", "google/gemma-2b-it")
 
+# Conversation storage
+CONVERSATION_DB = os.getenv("CONVERSATION_DB", str(
+    pathlib.Path(__file__).parent / "conversations.db"))
+CONVERSATION_BATCH_SIZE = int(os.getenv("CONVERSATION_BATCH_SIZE", "50"))
+CONVERSATION_FLUSH_SECONDS = int(os.getenv("CONVERSATION_FLUSH_SECONDS", "5"))
+CONVERSATION_RETENTION_DAYS = int(
+    os.getenv("CONVERSATION_RETENTION_DAYS", "180"))
+CONVERSATION_MAX_MB = int(os.getenv("CONVERSATION_MAX_MB", "512"))
+
+# Vector store backend for RAG: "chroma" (in-memory) or "ann" (memory-mapped ANN index)
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "chroma").lower()
+VECTOR_STORE_DIR = os.getenv("VECTOR_STORE_DIR", str(
+    pathlib.Path(__file__).parent / "vector_store"))
+VECTOR_STORAGE_DTYPE = os.getenv("VECTOR_STORAGE_DTYPE", "float16")
+# RAG corpus retention: near-duplicate threshold, document TTL, size cap and
+# how often new conversations are indexed and the store is compacted
+VECTOR_DEDUP_THRESHOLD = float(os.getenv("VECTOR_DEDUP_THRESHOLD", "0.97"))
+VECTOR_TTL_DAYS = int(os.getenv("VECTOR_TTL_DAYS", "180"))
+VECTOR_MAX_DOCS = int(os.getenv("VECTOR_MAX_DOCS", "200000"))
+VECTOR_MAINTENANCE_MINUTES = int(
+    os.getenv("VECTOR_MAINTENANCE_MINUTES", "60"))
+
+# Local intent routing (answers canned intents without a model call)
+INTENT_THRESHOLD = float(os.getenv("INTENT_THRESHOLD", "0.82"))
+# Multilingual embedding model for the intent classifier (empty disables it)
+INTENT_EMBEDDING_MODEL = os.getenv(
+    "INTENT_EMBEDDING_MODEL", "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2")
+# Telegram user ids allowed to use /stats (comma separated)
+ADMIN_USER_IDS = {int(uid) for uid in os.getenv(
+    "ADMIN_USER_IDS", "").split(",") if uid.strip()}
+
+# Outbound message pacing (Telegram flood limits)
+OUTBOUND_GLOBAL_RATE = float(os.getenv("OUTBOUND_GLOBAL_RATE", "25"))
+OUTBOUND_CHAT_RATE = float(os.getenv("OUTBOUND_CHAT_RATE", "1"))
+OUTBOUND_CHAT_BURST = int(os.getenv("OUTBOUND_CHAT_BURST", "3"))
+
+# Background media jobs
+JOB_DB = os.getenv("JOB_DB", str(pathlib.Path(__file__).parent / "jobs.db"))
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+# Queued jobs survive restarts, so pending Telegram updates are kept by default
+DROP_PENDING_UPDATES = os.getenv(
+    "DROP_PENDING_UPDATES", "false").lower() in ("1", "true", "yes")
+
+# HTTP connection pools and the executor for blocking SDK calls
+TELEGRAM_POOL_SIZE = int(os.getenv("TELEGRAM_POOL_SIZE", "100"))
+HF_POOL_SIZE = int(os.getenv("HF_POOL_SIZE", "10"))
+HTTP_KEEPALIVE_SECONDS = int(os.getenv("HTTP_KEEPALIVE_SECONDS", "30"))
+DNS_CACHE_SECONDS = int(os.getenv("DNS_CACHE_SECONDS", "300"))
+SDK_EXECUTOR_WORKERS = int(os.getenv("SDK_EXECUTOR_WORKERS", "8"))
+
 # Check for required tokens
 if not BOT_TOKEN:
     raise ValueError("You must set the BOT_TOKEN environment variable.")
@@ -60,18 +143,38 @@ def load_prompt(filename):
 TEXT_SYSTEM_PROMPT = load_prompt("text_system_prompt.md")
 AUDIO_SYSTEM_PROMPT = load_prompt("audio_system_prompt.md")
 IMAGE_SYSTEM_PROMPT = load_prompt("image_system_prompt.md")
+DOCUMENT_SYSTEM_PROMPT = "You have received a file. Analyze and summarize its content in modern, literate Georgian. If a caption is present, use it for context."
+TRANSCRIPTION_PROMPT = (
+    "Transcribe this audio to modern, literate Georgian. "
+    "Return only the transcription, no explanation."
+)
+VERIFY_TRANSCRIPTION_PROMPT = (
+    "Check the following Georgian transcription for accuracy and correct any errors. "
+    "Return only the improved transcription, no explanation."
+)
 # Load help and features text from markdown
 HELP_TEXT = load_prompt("help_text.md")
 FEATURES_TEXT = load_prompt("features_text.md")
 
+# Dedicated thread pool for blocking SDK calls (file uploads, Hugging Face inference)
+sdk_executor = SdkExecutor(max_workers=SDK_EXECUTOR_WORKERS)
+
 # Language Model API setup
+# An empty pool (no keys or model configured) means the service is unavailable
 try:
-    # genai.configure(api_key=GEMINI_API_KEY)
-    # gemini_model = genai.GenerativeModel(str(MODEL_NAME))
-    gemini_model = None  # Replace with your actual language model initialization
+    model_pool = ModelPool(
+        GEMINI_API_KEYS if GEMINI_FAST_MODEL else [],
+        fast_model=GEMINI_FAST_MODEL,
+        strong_model=GEMINI_STRONG_MODEL,
+        rpm_limit=GEMINI_KEY_RPM,
+        cooldown=GEMINI_THROTTLE_COOLDOWN,
+        strong_min_bytes=int(STRONG_MODEL_MIN_MB * 1024 * 1024),
+        cache_min_tokens=PROMPT_CACHE_MIN_TOKENS,
+        cache_ttl=PROMPT_CACHE_TTL,
+    )
 except Exception as e:
     logging.error(f"Language Model API configuration error: {e}")
-    gemini_model = None
+    model_pool = ModelPool([], fast_model=None)
 
 # RAG Setup
 # Use a common embedding model
@@ -82,24 +185,71 @@ embeddings = HuggingFaceEmbeddings(model_name=embedding_model_name)
 # For simplicity, we'll use in-memory for now. Change to persistent later if needed.
 # db_directory = "./chroma_db"
 # vectorstore = Chroma(persist_directory=db_directory, embedding_function=embeddings)
-vectorstore = Chroma(embedding_function=embeddings)
-
-# Hugging Face LLM setup
+# The "ann" backend persists float16/int8 vectors in a memory-mapped file with a
+# FAISS IVF index instead of keeping everything in Python heap memory.
+if VECTOR_BACKEND == "ann":
+    vectorstore = AnnVectorStore(
+        VECTOR_STORE_DIR, embeddings, storage_dtype=VECTOR_STORAGE_DTYPE)
+else:
+    vectorstore = Chroma(embedding_function=embeddings)
+
+# Hugging Face LLM setup (shared keep-alive connection pool)
+hf_http_adapter = configure_hf_http(pool_size=HF_POOL_SIZE)
 hf_llm = HuggingFaceHub(
     repo_id=HUGGING_FACE_MODEL,
     task="text-generation",
     huggingfacehub_api_token=HUGGING_FACE_API_KEY,
 )
 
-# Create Retrieval chain (basic setup)
+# Per-handler token budgets and token/latency accounting for model calls
+prompt_budget = PromptBudget({
+    "text": TEXT_TOKEN_BUDGET,
+    "image": IMAGE_CAPTION_TOKEN_BUDGET,
+    "document": DOCUMENT_CAPTION_TOKEN_BUDGET,
+    "voice_verify": VOICE_TOKEN_BUDGET,
+})
+
+# Create Retrieval chain (basic setup); retrieved documents are fitted into
+# what the question leaves of the text budget
 qa_chain = RetrievalQA.from_chain_type(
     llm=hf_llm,
     chain_type="stuff",  # Stuffing all retrieved documents into the prompt
-    retriever=vectorstore.as_retriever()
+    retriever=BudgetedRetriever(
+        retriever=vectorstore.as_retriever(), budget=prompt_budget, handler="text")
 )
 
+
+# Blocking chain call; records the assembled prompt, since the Hugging Face
+# endpoint reports no usage
+def run_qa(query):
+    capture = PromptCapture()
+    started = time.monotonic()
+    response = qa_chain.invoke({"query": query}, config={"callbacks": [capture]})
+    prompt_budget.record("text", capture.tokens,
+                         estimate_tokens((response or {}).get('result')),
+                         time.monotonic() - started, estimated=True)
+    return response
+
 router = Router()
 
+# Outbound delivery (pacing, flood-control retries, long message splitting)
+outbound = OutboundSender(
+    global_rate=OUTBOUND_GLOBAL_RATE,
+    chat_rate=OUTBOUND_CHAT_RATE,
+    chat_burst=OUTBOUND_CHAT_BURST,
+)
+
+# Persistent queue for heavy media work (documents, images, voice)
+job_queue = JobQueue(JOB_DB, workers=JOB_WORKERS,
+                     max_attempts=JOB_MAX_ATTEMPTS)
+
+# Telegram HTTP session(s), registered in main() for /stats
+telegram_sessions = []
+
+# Request coalescing for duplicate in-flight work
+text_flight = SingleFlight("qa")
+media_flight = SingleFlight("media")
+
 # /start command handler
 
 
@@ -107,7 +257,8 @@ router = Router()
 async def cmd_start(message: Message):
     user_full_name = getattr(
         getattr(message, 'from_user', None), 'full_name', 'მომხმარებელი')
-    await message.answer(
+    await outbound.answer(
+        message,
         f"გამარჯობა, {user_full_name}!\n"
         "მე ვარ შენი ასისტენტი. 🤖\n"
         "შეგიძლია გამომიგზავნო ტექსტი, ხმოვანი შეტყობინება ან სურათი!\n"
@@ -119,17 +270,61 @@ async def cmd_start(message: Message):
 
 @router.message(Command("help"))
 async def cmd_help(message: Message):
-    await message.answer(HELP_TEXT)
+    await outbound.answer(message, HELP_TEXT)
     log_conversation(message.from_user.id, getattr(
         message.from_user, 'username', ''), "/help", HELP_TEXT)
 
-# Provide help/features info on user request (text/voice)
-HELP_KEYWORDS = ["დახმარება", "help", "ფუნქცია",
-                 "შესაძლებლობა", "features", "რას აკეთებ", "რა შეგიძლია"]
+# Provide help/features info and canned replies on user request (text/voice)
+# The RAG embedding model is English-only; Georgian intents need a multilingual one
+if not INTENT_EMBEDDING_MODEL:
+    intent_embeddings = None
+elif INTENT_EMBEDDING_MODEL == embedding_model_name:
+    intent_embeddings = embeddings
+else:
+    intent_embeddings = HuggingFaceEmbeddings(model_name=INTENT_EMBEDDING_MODEL)
+intent_router = IntentRouter(
+    templates={
+        "help": HELP_TEXT,
+        "features": FEATURES_TEXT,
+        "greeting": "გამარჯობა! 👋 რით შემიძლია დაგეხმარო? შეგიძლია გამომიგზავნო ტექსტი, ხმოვანი შეტყობინება ან სურათი.",
+        "thanks": "არაფრის! 😊 თუ კიდევ რამე დაგჭირდება, მომწერე.",
+    },
+    embeddings=intent_embeddings,
+    threshold=INTENT_THRESHOLD,
+)
+
+# /stats command handler (admins only)
 
 
-def is_help_request(text):
-    return any(word in text.lower() for word in HELP_KEYWORDS)
+@router.message(Command("stats"))
+async def cmd_stats(message: Message):
+    if message.from_user.id not in ADMIN_USER_IDS:
+        return
+    await outbound.answer(message, format_stats())
+
+
+def collect_stats():
+    return {
+        "intent_router": intent_router.stats(),
+        "coalescing_qa": text_flight.stats(),
+        "coalescing_media": media_flight.stats(),
+        "outbound": outbound.stats(),
+        "jobs": job_queue.stats(),
+        "models": model_pool.stats(),
+        "telegram_http": telegram_sessions[0].stats() if telegram_sessions else {},
+        "huggingface_http": hf_http_adapter.stats(),
+        "sdk_executor": sdk_executor.stats(),
+        "tokens": prompt_budget.stats(),
+        "vector_store": vector_maintainer.stats(),
+    }
+
+
+def format_stats():
+    lines = []
+    for name, values in collect_stats().items():
+        lines.append(f"<b>{name}</b>")
+        lines.extend(f"{key}: {value}" for key, value in values.items())
+    return "\n".join(lines)
 
 # Helper to extract text from message (including caption, forwarded, etc.)
 
@@ -152,62 +347,207 @@ async def handle_text_and_caption_message(message: Message, bot: Bot):
     await bot.send_chat_action(message.chat.id, ChatAction.TYPING)
     user_text = extract_message_text(message)
 
-    # Check if the message is a help/features request
-    if is_help_request(user_text):
-        await message.answer(HELP_TEXT)
+    # Answer help/features/greeting/thanks locally, without calling a model
+    intent, canned_answer = await asyncio.to_thread(intent_router.route, user_text)
+    if intent:
+        await outbound.answer(message, canned_answer)
         log_conversation(message.from_user.id, getattr(
-            message.from_user, 'username', ''), user_text, "Sent help text")
-        return  # Stop processing if it's a help request
+            message.from_user, 'username', ''), user_text, f"Sent {intent} text")
+        return  # Stop processing if it's a canned intent
 
-    if not gemini_model:
-        await message.answer("უკაცრავად, სერვისი დროებით მიუწვდომელია. სცადეთ მოგვიანებით. 😔")
+    if not model_pool:
+        await outbound.answer(message, "უკაცრავად, სერვისი დროებით მიუწვდომელია. სცადეთ მოგვიანებით. 😔")
         log_conversation(message.from_user.id, getattr(
             message.from_user, 'username', ''), message.text, "სერვისი მიუწვდომელია")
         return
 
     if not user_text:
-        await message.answer("გთხოვთ, შეიყვანეთ ტექსტი ან გამოგზავნეთ შეტყობინება აღწერით. ✍️")
+        await outbound.answer(message, "გთხოვთ, შეიყვანეთ ტექსტი ან გამოგზავნეთ შეტყობინება აღწერით. ✍️")
         log_conversation(message.from_user.id, getattr(
             message.from_user, 'username', ''), user_text, "ტექსტი არ არის")
         return
-    processing_message = await message.answer("ვაზროვნებ... ")
+    processing_message = await outbound.answer(message, "ვაზროვნებ... ")
     try:
         # Use Retrieval chain to get response
-        # The qa_chain internally handles retrieval and generation
-        response = await qa_chain.invoke({"query": user_text})
-
-        await processing_message.delete()
-
+        # The qa_chain internally handles retrieval and generation;
+        # identical questions in flight share one chain call
+        # The question gets at most half of the text budget; the retrieved
+        # context gets the rest
+        query = prompt_budget.fit("text", user_text, TEXT_TOKEN_BUDGET // 2)
+        response = await text_flight.run(
+            normalize_query(query),
+            lambda: sdk_executor.run(run_qa, query))
         # The response from RetrievalQA is a dictionary, the answer is in the 'result' key
         if response and 'result' in response and response['result']:
             bot_response_text = response['result']
-            await message.answer(bot_response_text)
+            await outbound.reply(message, bot_response_text, placeholder=processing_message)
             log_conversation(message.from_user.id, getattr(
                 message.from_user, 'username', ''), user_text, bot_response_text)
         else:
             # Handle cases where Retrieval chain returns no result
             logging.warning(
                 f"Retrieval chain returned no result for query: {user_text}")
-            await message.answer("სამწუხაროდ, ვერ შევძელი თქვენს შეკითხვაზე პასუხის გაცემა კონტექსტის გამოყენებით. 😔")
+            await outbound.reply(message, "სამწუხაროდ, ვერ შევძელი თქვენს შეკითხვაზე პასუხის გაცემა კონტექსტის გამოყენებით. 😔", placeholder=processing_message)
             log_conversation(message.from_user.id, getattr(
                 message.from_user, 'username', ''), user_text, "Retrieval chain returned no result")
 
     except Exception as e:
-        await processing_message.delete()
         logging.error(
             f"Error in Retrieval chain processing: {e}", exc_info=True)
-        await message.answer("უკაცრავად, შეტყობინების დამუშავებისას მოხდა შეცდომა. 😵‍💫")
+        await outbound.reply(message, "უკაცრავად, შეტყობინების დამუშავებისას მოხდა შეცდომა. 😵‍💫", placeholder=processing_message)
         log_conversation(message.from_user.id, getattr(
             message.from_user, 'username', ''), user_text, "შეცდომა Retrieval დამუშავებისას")
 
+# Shared media pipeline: download a Telegram file, then on a Gemini slot from
+# the pool upload it, run `work(slot, resource)` and clean up afterwards.
+# Returns None when the download is empty.
+
+
+async def process_uploaded_file(bot: Bot, file_id, local_name, display_name, mime_type, tier, work):
+    with tempfile.TemporaryDirectory() as temp_dir_name:
+        local_path = pathlib.Path(temp_dir_name) / local_name
+        await bot.download(file=file_id, destination=local_path)
+        if local_path.stat().st_size == 0:
+            return None
+
+        async def upload_and_work(slot):
+            gemini_file_resource = None
+            try:
+                gemini_file_resource = await sdk_executor.run(
+                    slot.upload_file,
+                    path=local_path,
+                    display_name=display_name,
+                    mime_type=mime_type
+                )
+                return await work(slot, gemini_file_resource)
+            finally:
+                if gemini_file_resource and hasattr(gemini_file_resource, 'name'):
+                    try:
+                        await sdk_executor.run(slot.delete_file, name=gemini_file_resource.name)
+                    except Exception:
+                        pass  # Silent failure on file deletion is acceptable
+
+        # The pool retries on another key if this one is throttled
+        return await model_pool.run(tier, upload_and_work)
+
+# Collect prompt feedback / finish reasons for an empty model response
+
+
+def describe_empty_response(response):
+    safety_feedback_info = ""
+    if hasattr(response, 'prompt_feedback') and response.prompt_feedback:
+        safety_feedback_info += f"\nReason (prompt_feedback): {response.prompt_feedback}"
+    if hasattr(response, 'candidates') and response.candidates:
+        for i, candidate in enumerate(response.candidates):
+            if hasattr(candidate, 'finish_reason'):
+                safety_feedback_info += f"\nCandidate {i} (finish_reason): {candidate.finish_reason}"
+            if hasattr(candidate, 'safety_ratings'):
+                safety_feedback_info += f"\nCandidate {i} (safety_ratings): {candidate.safety_ratings}"
+    return safety_feedback_info
+
+# Errors worth another attempt from the job queue: throttled keys, server and
+# network failures
+
+
+def is_retryable_error(error):
+    return is_throttle_error(error) or isinstance(error, (
+        api_exceptions.ServerError,
+        api_exceptions.DeadlineExceeded,
+        TelegramNetworkError,
+        TelegramRetryAfter,
+        aiohttp.ClientError,
+        asyncio.TimeoutError,
+        ConnectionError,
+    ))
+
+# Called from a job runner's except block: retryable errors go back to the
+# queue until the last attempt; otherwise the user is told, the exchange is
+# recorded and JobFailed marks the job failed (the queue logs it)
+
+
+async def handle_job_error(bot: Bot, job, kind, error, user_text, log_text=None):
+    if is_retryable_error(error) and not job.get("last_attempt", True):
+        raise error
+    await outbound.reply_in_chat(bot, job["chat_id"], user_text, placeholder_id=job["placeholder_id"])
+    if log_text:
+        log_conversation(job["user_id"], job["username"], job["text"], log_text)
+    raise JobFailed(f"{kind} job for {job['file_id']}: {error}") from error
+
+# Everything a background job needs to answer in the originating chat,
+# serialisable so the job can be resumed after a restart
+
+
+def job_context(message: Message, processing_message: Message):
+    return {
+        "chat_id": message.chat.id,
+        "placeholder_id": processing_message.message_id,
+        "user_id": message.from_user.id,
+        "username": getattr(message.from_user, 'username', '') or '',
+        "text": message.text or '',
+    }
+
 # Enhanced image handler: supports photo and document with image MIME type
+# The handler only queues the work; run_image_job does the analysis in a worker
+
+
+async def analyze_image(bot: Bot, file_id, file_unique_id, ext, caption, tier):
+    async def describe(slot, gemini_file_resource):
+        # Combine caption if present
+        contents_for_gemini = []
+        if caption:
+            contents_for_gemini.append(
+                f"Caption: {prompt_budget.fit('image', caption)}")
+        contents_for_gemini.append(gemini_file_resource)
+        return await prompt_budget.generate(
+            slot, "image", contents_for_gemini, system_instruction=IMAGE_SYSTEM_PROMPT)
+
+    return await process_uploaded_file(
+        bot, file_id,
+        local_name=f"{file_unique_id}.{ext}",
+        display_name=f"image_message_{file_unique_id}.{ext}",
+        mime_type=f"image/{ext}" if ext in ['jpg', 'jpeg',
+                                            'png', 'gif', 'bmp', 'webp'] else 'image/jpeg',
+        tier=tier,
+        work=describe)
+
+
+async def run_image_job(bot: Bot, job):
+    chat_id, placeholder_id = job["chat_id"], job["placeholder_id"]
+    try:
+        # Identical images (same file_unique_id and caption) in flight share one analysis
+        response = await media_flight.run(
+            ("image", job["file_unique_id"], job["caption"]),
+            lambda: analyze_image(bot, job["file_id"], job["file_unique_id"], job["ext"], job["caption"],
+                                  model_pool.tier_for(job.get("file_size"))))
+        if response is None:
+            await outbound.edit_in_chat(bot, chat_id, placeholder_id, "Failed to download the image or the file is empty. 😥")
+            log_conversation(job["user_id"], job["username"],
+                             job["text"], "სურათი/ფაილი ცარიელია")
+            return
+        if response.text:
+            await outbound.reply_in_chat(bot, chat_id, response.text, placeholder_id=placeholder_id)
+            log_conversation(job["user_id"], job["username"],
+                             job["text"], response.text)
+        else:
+            # Handle cases where the main response is empty
+            logging.warning(
+                f"Language model API returned an empty response for image: {job['file_id']}")
+            safety_feedback_info = describe_empty_response(response)
+            logging.warning(safety_feedback_info)
+            await outbound.reply_in_chat(bot, chat_id, f"სამწუხაროდ, ვერ შევძელი სურათის აღწერა. 🖼️❌ მას შეიძლება მოხდეს, რომ შეტყობინება არ შეიძლება განმოწმებული ან წესებს შეერწყმა.{safety_feedback_info if safety_feedback_info else ''}", placeholder_id=placeholder_id)
+            log_conversation(job["user_id"], job["username"],
+                             job["text"], "სურათის აღწერა ვერ მოხერხდა")
+    except Exception as e:
+        await handle_job_error(bot, job, "Image", e,
+                               "უკაცრავად, სურათის დამუშავებისას მოხდა შეცდომა. 😵‍💫",
+                               "შეცდომა სურათის დამუშავებისას")
 
 
 @router.message(F.photo | (F.document & (F.document.mime_type.startswith('image/'))))
 async def handle_image_message(message: Message, bot: Bot):
     await bot.send_chat_action(message.chat.id, ChatAction.TYPING)
-    if not gemini_model:
-        await message.answer("უკაცრავად, სერვისი დროებით მიუწვდომელია სურათებისთვის. 😔")
+    if not model_pool:
+        await outbound.answer(message, "უკაცრავად, სერვისი დროებით მიუწვდომელია სურათებისთვის. 😔")
         log_conversation(message.from_user.id, getattr(
             message.from_user, 'username', ''), message.text, "სერვისი მიუწვდომელია")
         return
@@ -218,322 +558,331 @@ async def handle_image_message(message: Message, bot: Bot):
         photo = message.photo[-1]
         file_id = photo.file_id
         file_unique_id = photo.file_unique_id
+        file_size = photo.file_size
         ext = 'jpg'
     elif message.document:
         file_id = message.document.file_id
         file_unique_id = message.document.file_unique_id
+        file_size = message.document.file_size
         ext = message.document.file_name.split(
             '.')[-1] if message.document.file_name else 'img'
     else:
-        await message.answer("მოთხოვნაში სურათი ვერ მოიძებნა.")
+        await outbound.answer(message, "მოთხოვნაში სურათი ვერ მოიძებნა.")
         return
-    processing_message = await message.answer("სურათის ანალიზი მიმდინარეობს... 🖼️👀")
-    gemini_file_resource = None
-    with tempfile.TemporaryDirectory() as temp_dir_name:
-        temp_dir_path = pathlib.Path(temp_dir_name)
-        local_img_path = temp_dir_path / f"{file_unique_id}.{ext}"
-        try:
-            await bot.download(file=file_id, destination=local_img_path)
-            if local_img_path.stat().st_size == 0:
-                await processing_message.edit_text("Failed to download the image or the file is empty. 😥")
-                log_conversation(message.from_user.id, getattr(
-                    message.from_user, 'username', ''), message.text, "სურათი/ფაილი ცარიელია")
-                return
-            gemini_file_resource = await asyncio.to_thread(
-                genai.upload_file,
-                path=local_img_path,
-                display_name=f"image_message_{file_unique_id}.{ext}",
-                mime_type=f"image/{ext}" if ext in ['jpg', 'jpeg',
-                                                    'png', 'gif', 'bmp', 'webp'] else 'image/jpeg'
-            )
-            # Combine caption if present
-            caption = extract_message_text(message)
-            contents_for_gemini = [IMAGE_SYSTEM_PROMPT]
-            if caption:
-                contents_for_gemini.append(f"Caption: {caption}")
-            contents_for_gemini.append(gemini_file_resource)
-            response = await gemini_model.generate_content_async(contents_for_gemini)
-            await processing_message.delete()
-            if response.text:
-                await message.answer(response.text)
-                log_conversation(message.from_user.id, getattr(
-                    message.from_user, 'username', ''), message.text, response.text)
-            else:
-                # Handle cases where the main response is empty
-                logging.warning(
-                    f"Language model API returned an empty response for image: {file_id}")
-                safety_feedback_info = ""
-                if hasattr(response, 'prompt_feedback') and response.prompt_feedback:
-                    safety_feedback_info += f"\nReason (prompt_feedback): {response.prompt_feedback}"
-                if hasattr(response, 'candidates') and response.candidates:
-                    for i, candidate in enumerate(response.candidates):
-                        if hasattr(candidate, 'finish_reason'):
-                            safety_feedback_info += f"\nCandidate {i} (finish_reason): {candidate.finish_reason}"
-                        if hasattr(candidate, 'safety_ratings'):
-                            safety_feedback_info += f"\nCandidate {i} (safety_ratings): {candidate.safety_ratings}"
-                logging.warning(safety_feedback_info)
-                await message.answer(f"სამწუხაროდ, ვერ შევძელი სურათის აღწერა. 🖼️❌ მას შეიძლება მოხდეს, რომ შეტყობინება არ შეიძლება განმოწმებული ან წესებს შეერწყმა.{safety_feedback_info if safety_feedback_info else ''}")
-                log_conversation(message.from_user.id, getattr(
-                    message.from_user, 'username', ''), message.text, "სურათის აღწერა ვერ მოხერხდა")
-        except Exception as e:
-            await processing_message.delete()
-            await message.answer("უკაცრავად, სურათის დამუშავებისას მოხდა შეცდომა. 😵‍💫")
-            log_conversation(message.from_user.id, getattr(
-                message.from_user, 'username', ''), message.text, "შეცდომა სურათის დამუშავებისას")
-        finally:
-            if gemini_file_resource and hasattr(gemini_file_resource, 'name'):
-                try:
-                    await asyncio.to_thread(genai.delete_file, name=gemini_file_resource.name)
-                except Exception:
-                    pass  # Silent failure on file deletion is acceptable
+    processing_message = await outbound.answer(message, "სურათის ანალიზი მიმდინარეობს... 🖼️👀")
+    job_queue.enqueue("image", {
+        **job_context(message, processing_message),
+        "file_id": file_id,
+        "file_unique_id": file_unique_id,
+        "ext": ext,
+        "file_size": file_size,
+        "caption": extract_message_text(message),
+    }, priority=PRIORITY_MEDIA)
 
 # Enhanced document/file handler (non-image)
 
 
+async def analyze_document(bot: Bot, file_id, file_name, mime_type, caption, tier):
+    async def summarize(slot, gemini_file_resource):
+        contents_for_gemini = []
+        if caption:
+            contents_for_gemini.append(
+                f"Caption: {prompt_budget.fit('document', caption)}")
+        contents_for_gemini.append(gemini_file_resource)
+        return await prompt_budget.generate(
+            slot, "document", contents_for_gemini, system_instruction=DOCUMENT_SYSTEM_PROMPT)
+
+    return await process_uploaded_file(
+        bot, file_id,
+        local_name=file_name,
+        display_name=file_name,
+        mime_type=mime_type or 'application/octet-stream',
+        tier=tier,
+        work=summarize)
+
+
+async def run_document_job(bot: Bot, job):
+    chat_id, placeholder_id = job["chat_id"], job["placeholder_id"]
+    try:
+        response = await media_flight.run(
+            ("document", job["file_unique_id"], job["caption"]),
+            lambda: analyze_document(bot, job["file_id"], job["file_name"], job["mime_type"], job["caption"],
+                                     model_pool.tier_for(job.get("file_size"))))
+        if response is None:
+            await outbound.edit_in_chat(bot, chat_id, placeholder_id, "Failed to download the file or the file is empty. 😥")
+            log_conversation(job["user_id"], job["username"],
+                             job["text"], "ფაილი ცარიელია")
+            return
+        if response.text:
+            await outbound.reply_in_chat(bot, chat_id, response.text, placeholder_id=placeholder_id)
+            log_conversation(job["user_id"], job["username"],
+                             job["text"], response.text)
+        else:
+            await outbound.reply_in_chat(bot, chat_id, "სამწუხაროდ, ვერ შევძელი ფაილის დამუშავება. 📄❌", placeholder_id=placeholder_id)
+    except Exception as e:
+        await handle_job_error(bot, job, "Document", e,
+                               "უკაცრავად, ფაილის დამუშავებისას მოხდა შეცდომა. 😵‍💫")
+
+
 @router.message(F.document & ~(F.document.mime_type.startswith('image/')))
 async def handle_document_message(message: Message, bot: Bot):
     await bot.send_chat_action(message.chat.id, ChatAction.TYPING)
-    if not gemini_model:
-        await message.answer("უკაცრავად, სერვისი დროებით მიუწვდომელია ფაილებისთვის. 😔")
+    if not model_pool:
+        await outbound.answer(message, "უკაცრავად, სერვისი დროებით მიუწვდომელია ფაილებისთვის. 😔")
         log_conversation(message.from_user.id, getattr(
             message.from_user, 'username', ''), message.text, "სერვისი მიუწვდომელია")
         return
-    file_id = message.document.file_id
-    file_unique_id = message.document.file_unique_id
     file_name = message.document.file_name or 'file'
-    processing_message = await message.answer(f"მიმდინარეობს ფაილის '{file_name}' დამუშავება... 📄")
-    gemini_file_resource = None
-    with tempfile.TemporaryDirectory() as temp_dir_name:
-        temp_dir_path = pathlib.Path(temp_dir_name)
-        local_file_path = temp_dir_path / file_name
-        try:
-            await bot.download(file=file_id, destination=local_file_path)
-            if local_file_path.stat().st_size == 0:
-                await processing_message.edit_text("Failed to download the file or the file is empty. 😥")
-                log_conversation(message.from_user.id, getattr(
-                    message.from_user, 'username', ''), message.text, "ფაილი ცარიელია")
-                return
-            gemini_file_resource = await asyncio.to_thread(
-                genai.upload_file,
-                path=local_file_path,
-                display_name=file_name,
-                mime_type=message.document.mime_type or 'application/octet-stream'
-            )
-            caption = extract_message_text(message)
-            contents_for_gemini = [
-                f"You have received a file. Analyze and summarize its content in modern, literate Georgian. If a caption is present, use it for context.",
-            ]
-            if caption:
-                contents_for_gemini.append(f"Caption: {caption}")
-            contents_for_gemini.append(gemini_file_resource)
-            response = await gemini_model.generate_content_async(contents_for_gemini)
-            await processing_message.delete()
-            if response.text:
-                await message.answer(response.text)
-                log_conversation(message.from_user.id, getattr(
-                    message.from_user, 'username', ''), message.text, response.text)
-            else:
-                await message.answer("სამწუხაროდ, ვერ შევძელი ფაილის დამუშავება. 📄❌")
-        except Exception as e:
-            await processing_message.delete()
-            await message.answer("უკაცრავად, ფაილის დამუშავებისას მოხდა შეცდომა. 😵‍💫")
-        finally:
-            if gemini_file_resource and hasattr(gemini_file_resource, 'name'):
-                try:
-                    await asyncio.to_thread(genai.delete_file, name=gemini_file_resource.name)
-                except Exception:
-                    pass
+    processing_message = await outbound.answer(message, f"მიმდინარეობს ფაილის '{file_name}' დამუშავება... 📄")
+    job_queue.enqueue("document", {
+        **job_context(message, processing_message),
+        "file_id": message.document.file_id,
+        "file_unique_id": message.document.file_unique_id,
+        "file_name": file_name,
+        "mime_type": message.document.mime_type,
+        "file_size": message.document.file_size,
+        "caption": extract_message_text(message),
+    }, priority=PRIORITY_BULK)
 
 # Voice message handler
+# Returns (verified_transcription, response)
+
+
+async def analyze_voice(bot: Bot, file_id, file_unique_id, tier):
+    async def transcribe_and_reply(slot, gemini_file_resource):
+        # Step 1: Ask language model to transcribe only (Georgian, monospace)
+        transcription_response = await prompt_budget.generate(
+            slot, "voice_transcribe", [gemini_file_resource],
+            system_instruction=TRANSCRIPTION_PROMPT)
+        transcription = (transcription_response.text or "").strip()
+        # Step 2: Double-check/correct the transcription
+        verify_response = await prompt_budget.generate(
+            slot, "voice_verify",
+            f"Transcription: {prompt_budget.fit('voice_verify', transcription)}",
+            system_instruction=VERIFY_TRANSCRIPTION_PROMPT)
+        verified_transcription = (
+            verify_response.text or transcription).strip()
+        # Step 3: Generate the final reply as before
+        response = await prompt_budget.generate(
+            slot, "voice_reply", [gemini_file_resource],
+            system_instruction=AUDIO_SYSTEM_PROMPT)
+        return verified_transcription, response
+
+    return await process_uploaded_file(
+        bot, file_id,
+        local_name=f"{file_unique_id}.ogg",
+        display_name=f"voice_message_{file_unique_id}.ogg",
+        mime_type="audio/ogg",
+        tier=tier,
+        work=transcribe_and_reply)
+
+
+async def run_voice_job(bot: Bot, job):
+    chat_id, placeholder_id = job["chat_id"], job["placeholder_id"]
+    try:
+        result = await media_flight.run(
+            ("voice", job["file_unique_id"]),
+            lambda: analyze_voice(bot, job["file_id"], job["file_unique_id"],
+                                  model_pool.tier_for(job.get("file_size"))))
+        if result is None:
+            await outbound.edit_in_chat(bot, chat_id, placeholder_id, "აუდიო ფაილის ჩამოტვირთვა ვერ მოხერხდა ან ფაილი ცარიელია. 😥")
+            log_conversation(job["user_id"], job["username"],
+                             job["text"], "აუდიო ფაილი ცარიელია")
+            return
+        verified_transcription, response = result
+        # Send the verified transcription to the user in monospace/code format,
+        # in place of the placeholder; the reply then follows as a new message
+        if verified_transcription:
+            await outbound.reply_in_chat(bot, chat_id, f"<code>{verified_transcription}</code>", placeholder_id=placeholder_id, parse_mode="HTML")
+            placeholder_id = None
+        if response.text:
+            await outbound.reply_in_chat(bot, chat_id, response.text, placeholder_id=placeholder_id)
+            log_conversation(job["user_id"], job["username"],
+                             verified_transcription, response.text)
+        else:
+            # Handle cases where the main response is empty
+            logging.warning(
+                f"Language model API returned an empty response for audio: {job['file_id']}")
+            safety_feedback_info = describe_empty_response(response)
+            logging.warning(safety_feedback_info)
+            await outbound.reply_in_chat(bot, chat_id, f"სამწუხაროდ, ვერ შევძელი თქვენი ხმოვანი შეტყობინების დამუშავება. 🎤❌ მას შეიძლება მოხდეს, რომ შეტყობინება არ შეიძლება განმოწმებული ან წესებს შეერწყმა.{safety_feedback_info if safety_feedback_info else ''}", placeholder_id=placeholder_id)
+            log_conversation(job["user_id"], job["username"], verified_transcription,
+                             f"პასუხი ვერ გენერირდა. სამწუხაროდ, ვერ შევძელი თქვენი ხმოვანი შეტყობინების დამუშავება. მას შეიძლება მოხდეს, რომ შეტყობინება არ შეიძლება განმოწმებული ან წესებს შეერწყმა.")
+    except Exception as e:
+        await handle_job_error(bot, {**job, "placeholder_id": placeholder_id}, "Voice", e,
+                               "უკაცრავად, ხმოვანი შეტყობინების დამუშავებისას მოხდა შეცდომა. 😵‍💫 სცადეთ მოგვიანებით.",
+                               "შეცდომა ხმოვანი შეტყობინების დამუშავებისას")
 
 
 @router.message(F.voice)
 async def handle_voice_message(message: Message, bot: Bot):
     await bot.send_chat_action(message.chat.id, ChatAction.TYPING)
-    if not gemini_model:
-        await message.answer("უკაცრავად, სერვისი დროებით მიუწვდომელია აუდიოსთვის. 😔")
+    if not model_pool:
+        await outbound.answer(message, "უკაცრავად, სერვისი დროებით მიუწვდომელია აუდიოსთვის. 😔")
         log_conversation(message.from_user.id, getattr(
             message.from_user, 'username', ''), message.text, "სერვისი მიუწვდომელია")
         return
     voice = getattr(message, 'voice', None)
     if voice is None:
-        await message.answer("მოთხოვნაში ხმოვანი შეტყობინება ვერ მოიძებნა.")
+        await outbound.answer(message, "მოთხოვნაში ხმოვანი შეტყობინება ვერ მოიძებნა.")
         log_conversation(message.from_user.id, getattr(
             message.from_user, 'username', ''), message.text, "ხმოვანი შეტყობინება ვერ მოიძებნა")
         return
-    processing_message = await message.answer("მიმდინარეობს თქვენი ხმოვანი შეტყობინების დამუშავება... 🎤🎧")
-    gemini_file_resource = None
-    with tempfile.TemporaryDirectory() as temp_dir_name:
-        temp_dir_path = pathlib.Path(temp_dir_name)
-        local_ogg_path = temp_dir_path / f"{voice.file_unique_id}.ogg"
-        try:
-            await bot.download(file=voice.file_id, destination=local_ogg_path)
-            if local_ogg_path.stat().st_size == 0:
-                await processing_message.edit_text("აუდიო ფაილის ჩამოტვირთვა ვერ მოხერხდა ან ფაილი ცარიელია. 😥")
-                log_conversation(message.from_user.id, getattr(
-                    message.from_user, 'username', ''), message.text, "აუდიო ფაილი ცარიელია")
-                return
-            # Step 1: Transcribe the audio using language model
-            gemini_file_resource = await asyncio.to_thread(
-                genai.upload_file,
-                path=local_ogg_path,
-                display_name=f"voice_message_{voice.file_unique_id}.ogg",
-                mime_type="audio/ogg"
-            )
-            # Step 2: Ask language model to transcribe only (Georgian, monospace)
-            transcription_prompt = (
-                "Transcribe this audio to modern, literate Georgian. "
-                "Return only the transcription, no explanation."
-            )
-            transcription_response = await gemini_model.generate_content_async([
-                transcription_prompt,
-                gemini_file_resource
-            ])
-            transcription = (transcription_response.text or "").strip()
-            # Step 3: Double-check/correct the transcription
-            verify_prompt = (
-                "Check the following Georgian transcription for accuracy and correct any errors. "
-                "Return only the improved transcription, no explanation."
-            )
-            verify_response = await gemini_model.generate_content_async(
-                f"{verify_prompt}\n\nTranscription: {transcription}"
-            )
-            verified_transcription = (
-                verify_response.text or transcription).strip()
-            # Step 4: Send the verified transcription to the user in monospace/code format
-            if verified_transcription:
-                await message.answer(f"<code>{verified_transcription}</code>", parse_mode="HTML")
-            # Step 5: Generate the final reply as before
-            contents_for_gemini = [AUDIO_SYSTEM_PROMPT, gemini_file_resource]
-            response = await gemini_model.generate_content_async(contents_for_gemini)
-            await processing_message.delete()
-            if response.text:
-                await message.answer(response.text)
-                log_conversation(message.from_user.id, getattr(
-                    message.from_user, 'username', ''), verified_transcription, response.text)
-            else:
-                # Handle cases where the main response is empty
-                logging.warning(
-                    f"Language model API returned an empty response for audio: {voice.file_id}")
-                safety_feedback_info = ""
-                if hasattr(response, 'prompt_feedback') and response.prompt_feedback:
-                    safety_feedback_info += f"\nReason (prompt_feedback): {response.prompt_feedback}"
-                if hasattr(response, 'candidates') and response.candidates:
-                    for i, candidate in enumerate(response.candidates):
-                        if hasattr(candidate, 'finish_reason'):
-                            safety_feedback_info += f"\nCandidate {i} (finish_reason): {candidate.finish_reason}"
-                        if hasattr(candidate, 'safety_ratings'):
-                            safety_feedback_info += f"\nCandidate {i} (safety_ratings): {candidate.safety_ratings}"
-                logging.warning(safety_feedback_info)
-                await message.answer(f"სამწუხაროდ, ვერ შევძელი თქვენი ხმოვანი შეტყობინების დამუშავება. 🎤❌ მას შეიძლება მოხდეს, რომ შეტყობინება არ შეიძლება განმოწმებული ან წესებს შეერწყმა.{safety_feedback_info if safety_feedback_info else ''}")
-                log_conversation(message.from_user.id, getattr(message.from_user, 'username', ''), verified_transcription,
-                                 f"პასუხი ვერ გენერირდა. სამწუხაროდ, ვერ შევძელი თქვენი ხმოვანი შეტყობინების დამუშავება. მას შეიძლება მოხდეს, რომ შეტყობინება არ შეიძლება განმოწმებული ან წესებს შეერწყმა.")
-        except Exception as e:
-            await processing_message.delete()
-            await message.answer("უკაცრავად, ხმოვანი შეტყობინების დამუშავებისას მოხდა შეცდომა. 😵‍💫 სცადეთ მოგვიანებით.")
-            log_conversation(message.from_user.id, getattr(
-                message.from_user, 'username', ''), message.text, "შეცდომა ხმოვანი შეტყობინების დამუშავებისას")
-        finally:
-            if gemini_file_resource and hasattr(gemini_file_resource, 'name'):
-                try:
-                    await asyncio.to_thread(genai.delete_file, name=gemini_file_resource.name)
-                except Exception:
-                    pass  # Silent failure on file deletion is acceptable
+    processing_message = await outbound.answer(message, "მიმდინარეობს თქვენი ხმოვანი შეტყობინების დამუშავება... 🎤🎧")
+    job_queue.enqueue("voice", {
+        **job_context(message, processing_message),
+        "file_id": voice.file_id,
+        "file_unique_id": voice.file_unique_id,
+        "file_size": voice.file_size,
+    }, priority=PRIORITY_INTERACTIVE)
 
 # Video handler
 
 
 @router.message(F.video)
 async def handle_video_message(message: Message, bot: Bot):
-    await message.answer("ვიდეო შეტყობინებების ანალიზი ჯერ არ არის მხარდაჭერილი, მაგრამ ეს ფუნქცია მალე დაემატება. 🎬")
+    await outbound.answer(message, "ვიდეო შეტყობინებების ანალიზი ჯერ არ არის მხარდაჭერილი, მაგრამ ეს ფუნქცია მალე დაემატება. 🎬")
 
 # Audio handler
 
 
 @router.message(F.audio)
 async def handle_audio_message(message: Message, bot: Bot):
-    await message.answer("აუდიო ფაილების ანალიზი ჯერ არ არის მხარდაჭერილი, მაგრამ ეს ფუნქცია მალე დაემატება. 🎵")
+    await outbound.answer(message, "აუდიო ფაილების ანალიზი ჯერ არ არის მხარდაჭერილი, მაგრამ ეს ფუნქცია მალე დაემატება. 🎵")
 
 # Sticker handler
 
 
 @router.message(F.sticker)
 async def handle_sticker_message(message: Message):
-    await message.answer("სტიკერები სახალისოა! 😄 თუმცა, სტიკერების ანალიზი ჯერ არ შემიძლია.")
+    await outbound.answer(message, "სტიკერები სახალისოა! 😄 თუმცა, სტიკერების ანალიზი ჯერ არ შემიძლია.")
 
 # Contact handler
 
 
 @router.message(F.contact)
 async def handle_contact_message(message: Message):
-    await message.answer("გამოგზავნილია კონტაქტი. კონტაქტების დამუშავება ჯერ არ შემიძლია, მაგრამ სხვა რამეზე თუ გჭირდებათ დახმარება, მომწერეთ!")
+    await outbound.answer(message, "გამოგზავნილია კონტაქტი. კონტაქტების დამუშავება ჯერ არ შემიძლია, მაგრამ სხვა რამეზე თუ გჭირდებათ დახმარება, მომწერეთ!")
 
 # Location handler
 
 
 @router.message(F.location)
 async def handle_location_message(message: Message):
-    await message.answer("გამოგზავნილია ლოკაცია. ლოკაციების დამუშავება ჯერ არ შემიძლია, მაგრამ სხვა რამეზე თუ გჭირდებათ დახმარება, მომწერეთ!")
+    await outbound.answer(message, "გამოგზავნილია ლოკაცია. ლოკაციების დამუშავება ჯერ არ შემიძლია, მაგრამ სხვა რამეზე თუ გჭირდებათ დახმარება, მომწერეთ!")
 
 # Log conversation
+# Legacy CSV log, migrated into the SQLite store on first start
 LOG_FILE = pathlib.Path(__file__).parent / "user_conversations.csv"
+conversation_store = ConversationStore(
+    CONVERSATION_DB, batch_size=CONVERSATION_BATCH_SIZE)
+
+# Feeds conversations into the vector store (skipping error/placeholder
+# responses and near-duplicates) and applies TTL, size cap and compaction
+vector_maintainer = VectorMaintainer(
+    vectorstore, conversation_store, embeddings,
+    dedup_threshold=VECTOR_DEDUP_THRESHOLD,
+    ttl_days=VECTOR_TTL_DAYS,
+    max_docs=VECTOR_MAX_DOCS,
+)
 
 
 def log_conversation(user_id, username, message, response):
-    with open(LOG_FILE, "a", encoding="utf-8", newline="") as f:
-        writer = csv.writer(f)
-        writer.writerow([
-            datetime.now().isoformat(),
-            user_id,
-            username,
-            message.replace("\n", " "),
-            response.replace("\n", " ") if response else ""
-        ])
-
-# Function to load data from CSV and populate vectorstore
-
-
-def load_conversations_to_chroma(file_path: pathlib.Path):
-    if not file_path.exists():
-        logging.warning(
-            f"Conversation log file not found at {file_path}. No data loaded to Chroma.")
-        return
+    # add() only buffers; a full batch is written off the event loop
+    if conversation_store.add(user_id, username, message, response):
+        asyncio.get_running_loop().run_in_executor(None, conversation_store.flush)
+
+# Function to load data from the conversation store and populate vectorstore
+
+
+def load_conversations_to_chroma():
     try:
-        # Using CSVLoader from Langchain
-        # loader = CSVLoader(file_path=str(file_path))
-        # documents = loader.load()
-
-        # if not documents:
-        #     logging.info("No documents loaded from conversation log.")
-        #     return
-
-        # Add documents to vectorstore
-        # Note: This will re-add documents every time the bot starts if using in-memory Chroma.
-        # For persistent Chroma, you'd check if the collection exists and is populated.
-        # vectorstore.add_documents(documents)
+        loaded = vector_maintainer.ingest()
+        vector_maintainer.prune()
+        if not loaded:
+            logging.info("No new documents loaded from conversation store.")
+            return
         logging.info(
-            f"Loaded 0 documents into Chroma from {file_path}.")
+            f"Loaded {loaded} documents into the vector store from {conversation_store.db_path}.")
 
     except Exception as e:
-        logging.error(f"Error loading conversations to Chroma: {e}")
+        logging.error(f"Error loading conversations to the vector store: {e}")
+
+# Periodically flush buffered conversation rows and rotate old data
+
+
+async def conversation_maintenance():
+    rotate_every = max(3600 // CONVERSATION_FLUSH_SECONDS, 1)
+    ticks = 0
+    while True:
+        await asyncio.sleep(CONVERSATION_FLUSH_SECONDS)
+        try:
+            await asyncio.to_thread(conversation_store.flush)
+            ticks += 1
+            if ticks % rotate_every == 0:
+                await asyncio.to_thread(
+                    conversation_store.rotate,
+                    max_age_days=CONVERSATION_RETENTION_DAYS,
+                    max_bytes=CONVERSATION_MAX_MB * 1024 * 1024)
+        except Exception as e:
+            logging.error(f"Conversation store maintenance error: {e}")
+
+# Periodically index new conversations, expire old documents and compact the vector store.
+# The first pass fills the vector store in a worker thread, so polling starts right away
+
+
+async def vector_maintenance():
+    await asyncio.to_thread(load_conversations_to_chroma)
+    while True:
+        await asyncio.sleep(VECTOR_MAINTENANCE_MINUTES * 60)
+        try:
+            await asyncio.to_thread(vector_maintainer.run_cycle)
+        except Exception as e:
+            logging.error(f"Vector store maintenance error: {e}")
 
 
 async def main():
     default_properties = DefaultBotProperties(parse_mode=ParseMode.HTML)
-    bot = Bot(token=str(BOT_TOKEN), default=default_properties)
+    # API calls and file downloads share one keep-alive pool with DNS caching
+    session = PooledAiohttpSession(
+        limit=TELEGRAM_POOL_SIZE,
+        keepalive_timeout=HTTP_KEEPALIVE_SECONDS,
+        dns_cache_seconds=DNS_CACHE_SECONDS,
+    )
+    bot = Bot(token=str(BOT_TOKEN), session=session,
+              default=default_properties)
+    telegram_sessions.append(session)
     dp = Dispatcher()
 
     dp.include_router(router)
 
-    # Load conversation data into Chroma on startup
-    load_conversations_to_chroma(LOG_FILE)
+    # One-shot migration of the legacy CSV log; vector_maintenance then loads
+    # conversation data into the vector store in the background
+    conversation_store.migrate_from_csv(LOG_FILE)
+    await asyncio.to_thread(intent_router.prepare)
+    maintenance_task = asyncio.create_task(conversation_maintenance())
+    vector_task = asyncio.create_task(vector_maintenance())
+
+    # Start the media workers; jobs interrupted by the last shutdown are resumed
+    job_queue.register("image", lambda job: run_image_job(bot, job))
+    job_queue.register("document", lambda job: run_document_job(bot, job))
+    job_queue.register("voice", lambda job: run_voice_job(bot, job))
+    job_queue.start()
 
-    await bot.delete_webhook(drop_pending_updates=True)
+    await bot.delete_webhook(drop_pending_updates=DROP_PENDING_UPDATES)
 
     logging.info("Bot is starting...")
     try:
         await dp.start_polling(bot)
     finally:
+        logging.info(f"Stats: {collect_stats()}")
+        maintenance_task.cancel()
+        vector_task.cancel()
+        await job_queue.stop()
+        conversation_store.close()
+        if isinstance(vectorstore, AnnVectorStore):
+            vectorstore.close()
+        sdk_executor.shutdown()
         await bot.session.close()
         logging.info("Bot stopped.")
 
@@ -0,0 +1,296 @@
+import csv
+import gzip
+import json
+import logging
+import pathlib
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+
+# SQLite-backed conversation storage (replaces the flat user_conversations.csv)
+# - WAL journal so readers (RAG ingestion, history lookups) never block the writer
+# - indexes on user_id and timestamp for per-user / time-range queries
+# - inserts are buffered in memory; add() never touches the database, the
+#   owner flushes the buffer from a background task
+# - old rows are archived to gzip-compressed JSONL files and removed from the
+#   db in short chunks; freed pages are returned with incremental vacuum, so
+#   maintenance never holds the connection for long
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS conversations (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    ts TEXT NOT NULL,
+    user_id INTEGER,
+    username TEXT,
+    message TEXT,
+    response TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_conversations_user_id ON conversations (user_id, ts);
+CREATE INDEX IF NOT EXISTS idx_conversations_ts ON conversations (ts);
+"""
+
+COLUMNS = ("ts", "user_id", "username", "message", "response")
+
+# Upper bound for row id range queries (SQLite INTEGER PRIMARY KEY)
+MAX_ROW_ID = 2 ** 63 - 1
+
+# Rows read or deleted, and pages vacuumed, per lock acquisition during rotation
+ARCHIVE_CHUNK_ROWS = 5000
+VACUUM_CHUNK_PAGES = 2000
+
+
+class ConversationStore:
+    def __init__(self, db_path, archive_dir=None, batch_size=50):
+        self.db_path = pathlib.Path(db_path)
+        self.archive_dir = pathlib.Path(
+            archive_dir) if archive_dir else self.db_path.parent / "conversation_archive"
+        self.batch_size = batch_size
+        self._pending = []
+        self._pending_lock = threading.Lock()  # guards only the in-memory buffer
+        self._lock = threading.Lock()  # guards the connection
+        self._conn = sqlite3.connect(
+            str(self.db_path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        if self._conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            # Switching an existing database to incremental vacuum needs one full
+            # VACUUM; this runs once, at startup
+            self._conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            self._conn.execute("VACUUM")
+        self._conn.executescript(SCHEMA)
+        self._conn.commit()
+
+    # Queue a row in memory. Returns True once batch_size rows are waiting, so
+    # the caller can schedule an early flush() off the event loop.
+    def add(self, user_id, username, message, response):
+        row = (
+            datetime.now().isoformat(),
+            user_id,
+            username or "",
+            message or "",
+            response or "",
+        )
+        with self._pending_lock:
+            self._pending.append(row)
+            return len(self._pending) >= self.batch_size
+
+    def flush(self):
+        with self._pending_lock:
+            rows, self._pending = self._pending, []
+        if not rows:
+            return
+        try:
+            with self._lock, self._conn:
+                self._conn.executemany(
+                    "INSERT INTO conversations (ts, user_id, username, message, response) "
+                    "VALUES (?, ?, ?, ?, ?)", rows)
+        except sqlite3.Error as e:
+            logging.error(f"Failed to write {len(rows)} conversation rows: {e}")
+            # Keep the rows so the next flush can retry them
+            with self._pending_lock:
+                self._pending = rows + self._pending
+
+    def history(self, user_id, limit=20):
+        self.flush()
+        with self._lock:
+            cursor = self._conn.execute(
+                "SELECT ts, user_id, username, message, response FROM conversations "
+                "WHERE user_id = ? ORDER BY ts DESC LIMIT ?", (user_id, limit))
+            rows = cursor.fetchall()
+        return [dict(zip(COLUMNS, row)) for row in reversed(rows)]
+
+    # Yield rows (as dicts, with their row id) in insertion order, or newest
+    # first, optionally only newer than `since` or after row id `after_id`
+    def iter_rows(self, since=None, chunk_size=1000, after_id=0, newest_first=False):
+        self.flush()
+        query = ("SELECT id, ts, user_id, username, message, response FROM conversations "
+                 "WHERE id > ? AND id < ?")
+        if since:
+            query += " AND ts > ?"
+        query += " ORDER BY id DESC LIMIT ?" if newest_first else " ORDER BY id LIMIT ?"
+        low, high = after_id, MAX_ROW_ID
+        while True:
+            params = (low, high, since, chunk_size) if since else (low, high, chunk_size)
+            with self._lock:
+                chunk = self._conn.execute(query, params).fetchall()
+            if not chunk:
+                return
+            for row in chunk:
+                yield {"id": row[0], **dict(zip(COLUMNS, row[1:]))}
+            if newest_first:
+                high = chunk[-1][0]
+            else:
+                low = chunk[-1][0]
+
+    def count(self):
+        self.flush()
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM conversations").fetchone()[0]
+
+    def size_bytes(self):
+        with self._lock:
+            page_count = self._conn.execute("PRAGMA page_count").fetchone()[0]
+            page_size = self._conn.execute("PRAGMA page_size").fetchone()[0]
+        return page_count * page_size
+
+    # Archive rows older than max_age_days, and the oldest quarter of the table
+    # while the database is larger than max_bytes. Returns the number of archived rows.
+    def rotate(self, max_age_days=None, max_bytes=None):
+        self.flush()
+        archived = 0
+        if max_age_days:
+            cutoff = (datetime.now() - timedelta(days=max_age_days)).isoformat()
+            archived += self._archive_where("ts < ?", (cutoff,))
+        if max_bytes:
+            while self.size_bytes() > max_bytes:
+                total = self.count()
+                if total == 0:
+                    break
+                with self._lock:
+                    row = self._conn.execute(
+                        "SELECT ts FROM conversations ORDER BY ts LIMIT 1 OFFSET ?",
+                        (max(total // 4 - 1, 0),)).fetchone()
+                moved = self._archive_where("ts <= ?", (row[0],))
+                archived += moved
+                if moved == 0:
+                    break
+        return archived
+
+    # Archive matching rows: copy them to a gzip file chunk by chunk, then
+    # delete them in chunks and release the freed pages. The connection lock
+    # is only held per chunk, so flushes from the bot interleave with rotation.
+    def _archive_where(self, where, params):
+        self.archive_dir.mkdir(parents=True, exist_ok=True)
+        archive_path = self.archive_dir / \
+            f"conversations_{datetime.now().strftime('%Y%m%dT%H%M%S%f')}.jsonl.gz"
+        ids = []
+        last_id = 0
+        with gzip.open(archive_path, "wt", encoding="utf-8") as f:
+            while True:
+                with self._lock:
+                    chunk = self._conn.execute(
+                        f"SELECT id, ts, user_id, username, message, response FROM conversations "
+                        f"WHERE ({where}) AND id > ? ORDER BY id LIMIT ?",
+                        (*params, last_id, ARCHIVE_CHUNK_ROWS)).fetchall()
+                if not chunk:
+                    break
+                for row in chunk:
+                    f.write(json.dumps(dict(zip(COLUMNS, row[1:])),
+                            ensure_ascii=False) + "\n")
+                ids.extend(row[0] for row in chunk)
+                last_id = chunk[-1][0]
+        if not ids:
+            archive_path.unlink()
+            return 0
+        # The archive is complete before anything is deleted
+        for start in range(0, len(ids), ARCHIVE_CHUNK_ROWS):
+            chunk = ids[start:start + ARCHIVE_CHUNK_ROWS]
+            with self._lock, self._conn:
+                self._conn.execute(
+                    f"DELETE FROM conversations WHERE id IN ({','.join('?' * len(chunk))})", chunk)
+        self._release_pages()
+        logging.info(f"Archived {len(ids)} conversation rows to {archive_path}")
+        return len(ids)
+
+    # Checkpoint the WAL and hand free pages back to the OS a chunk at a time
+    def _release_pages(self):
+        with self._lock:
+            self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        previous = None
+        while True:
+            with self._lock:
+                free = self._conn.execute(
+                    "PRAGMA freelist_count").fetchone()[0]
+                if not free or free == previous:
+                    break
+                self._conn.execute(
+                    f"PRAGMA incremental_vacuum({VACUUM_CHUNK_PAGES})").fetchall()
+            previous = free
+        with self._lock:
+            self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    # One-shot import of the legacy CSV log; the CSV is renamed afterwards so
+    # the migration never runs twice
+    def migrate_from_csv(self, csv_path):
+        csv_path = pathlib.Path(csv_path)
+        if not csv_path.exists():
+            return 0
+        rows = []
+        with open(csv_path, encoding="utf-8", newline="") as f:
+            for record in csv.reader(f):
+                if len(record) < 5:
+                    continue
+                ts, user_id, username, message, response = record[:5]
+                try:
+                    user_id = int(user_id)
+                except ValueError:
+                    pass
+                rows.append((ts, user_id, username, message, response))
+        self.flush()
+        with self._lock:
+            with self._conn:
+                self._conn.executemany(
+                    "INSERT INTO conversations (ts, user_id, username, message, response) "
+                    "VALUES (?, ?, ?, ?, ?)", rows)
+        csv_path.rename(csv_path.with_name(csv_path.name + ".migrated"))
+        logging.info(f"Migrated {len(rows)} conversation rows from {csv_path}")
+        return len(rows)
+
+    # Export to Parquet for analytics (requires pyarrow)
+    def export_parquet(self, parquet_path, since=None):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise RuntimeError(
+                "pyarrow is required for Parquet export: pip install pyarrow")
+        columns = {name: [] for name in COLUMNS}
+        for row in self.iter_rows(since=since):
+            for name in COLUMNS:
+                columns[name].append(row[name])
+        columns["user_id"] = [
+            uid if isinstance(uid, int) else None for uid in columns["user_id"]]
+        table = pa.table(columns)
+        pq.write_table(table, str(parquet_path), compression="zstd")
+        return table.num_rows
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            self._conn.close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Conversation store maintenance")
+    parser.add_argument("--db", default=str(
+        pathlib.Path(__file__).parent / "conversations.db"))
+    sub = parser.add_subparsers(dest="command", required=True)
+    migrate_cmd = sub.add_parser("migrate", help="import a legacy CSV log")
+    migrate_cmd.add_argument("csv_path")
+    export_cmd = sub.add_parser("export", help="export rows to Parquet")
+    export_cmd.add_argument("parquet_path")
+    export_cmd.add_argument("--since", help="ISO timestamp lower bound")
+    rotate_cmd = sub.add_parser("rotate", help="archive old rows")
+    rotate_cmd.add_argument("--max-age-days", type=int)
+    rotate_cmd.add_argument("--max-mb", type=int)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO,
+                        format="%(asctime)s - %(levelname)s - %(message)s")
+    store = ConversationStore(args.db)
+    try:
+        if args.command == "migrate":
+            print(f"Migrated {store.migrate_from_csv(args.csv_path)} rows")
+        elif args.command == "export":
+            print(
+                f"Exported {store.export_parquet(args.parquet_path, since=args.since)} rows")
+        elif args.command == "rotate":
+            archived = store.rotate(
+                max_age_days=args.max_age_days,
+                max_bytes=args.max_mb * 1024 * 1024 if args.max_mb else None)
+            print(f"Archived {archived} rows")
+    finally:
+        store.close()
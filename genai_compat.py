@@ -0,0 +1,82 @@
+import google.generativeai as genai
+from google.api_core.client_options import ClientOptions
+from google.generativeai import caching
+from google.generativeai import client as genai_client
+from google.generativeai.types import file_types
+
+# Per-key access to google-generativeai.
+# The SDK only supports one global API key (genai.configure), so the key pool
+# reaches into a few private SDK members: per-model client attributes and the
+# cached-content request helpers. Every such hook lives in this module, and
+# check_sdk() verifies them and the SDK version at startup, so an SDK upgrade
+# fails immediately instead of on the first user request. The SDK version is pinned
+# in Pipfile for the same reason.
+
+TESTED_SDK_VERSIONS = ("0.8.",)
+
+
+def check_sdk():
+    if not genai.__version__.startswith(TESTED_SDK_VERSIONS):
+        raise RuntimeError(
+            f"google-generativeai {genai.__version__} has not been tested with the key pool; "
+            f"install a {'/'.join(v + 'x' for v in TESTED_SDK_VERSIONS)} release")
+    missing = []
+    for owner, name in (
+        (genai_client, "FileServiceClient"),
+        (genai_client.glm, "GenerativeServiceClient"),
+        (genai_client.glm, "GenerativeServiceAsyncClient"),
+        (genai_client.glm, "CacheServiceAsyncClient"),
+        (caching.CachedContent, "_prepare_create_request"),
+        (caching.CachedContent, "_from_obj"),
+        (genai.GenerativeModel, "from_cached_content"),
+    ):
+        if not hasattr(owner, name):
+            missing.append(f"{getattr(owner, '__name__', owner)}.{name}")
+    model = genai.GenerativeModel("models/check")
+    for name in ("_client", "_async_client"):
+        if not hasattr(model, name):
+            missing.append(f"GenerativeModel.{name}")
+    if missing:
+        raise RuntimeError(
+            f"google-generativeai {genai.__version__} is not compatible with the key pool "
+            f"(missing: {', '.join(missing)}); install a {'/'.join(v + 'x' for v in TESTED_SDK_VERSIONS)} release")
+
+
+class GenaiKeyClient:
+    def __init__(self, api_key):
+        client_options = ClientOptions(api_key=api_key)
+        self.file_client = genai_client.FileServiceClient(
+            client_options=client_options)
+        self.cache_client = genai_client.glm.CacheServiceAsyncClient(
+            client_options=client_options)
+        self._client = genai_client.glm.GenerativeServiceClient(
+            client_options=client_options)
+        self._async_client = genai_client.glm.GenerativeServiceAsyncClient(
+            client_options=client_options)
+
+    def _bind(self, model):
+        model._client = self._client
+        model._async_client = self._async_client
+        return model
+
+    # A GenerativeModel whose calls use this key
+    def model(self, model_name, system_instruction=None):
+        return self._bind(genai.GenerativeModel(
+            model_name, system_instruction=system_instruction))
+
+    # Upload `system_instruction` as cached content under this key and return
+    # a model that uses it
+    async def cached_model(self, model_name, system_instruction, ttl):
+        request = caching.CachedContent._prepare_create_request(
+            model=model_name, system_instruction=system_instruction, ttl=ttl)
+        cached = caching.CachedContent._from_obj(
+            await self.cache_client.create_cached_content(request))
+        return self._bind(genai.GenerativeModel.from_cached_content(cached))
+
+    def upload_file(self, path, display_name, mime_type):
+        response = self.file_client.create_file(
+            path=path, mime_type=mime_type, display_name=display_name)
+        return file_types.File(response)
+
+    def delete_file(self, name):
+        self.file_client.delete_file(name=name)
@@ -0,0 +1,167 @@
+import asyncio
+import functools
+import logging
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import aiohttp
+import requests
+from requests.adapters import HTTPAdapter
+from aiogram.client.session.aiohttp import AiohttpSession
+
+try:
+    from huggingface_hub import configure_http_backend
+except ImportError:  # removed when huggingface_hub moved to httpx
+    configure_http_backend = None
+
+# Managed HTTP layer:
+# - Telegram API calls and file downloads share one pooled keep-alive aiohttp
+#   connector with DNS caching, instrumented to count new vs reused connections
+# - Hugging Face Hub calls share one pooled requests adapter (on
+#   huggingface_hub releases that still accept a requests backend)
+# - blocking SDK calls run on a dedicated, sized thread pool instead of the
+#   default executor, with queue/active metrics to show saturation
+
+
+class PooledAiohttpSession(AiohttpSession):
+    def __init__(self, limit=100, keepalive_timeout=30, dns_cache_seconds=300, **kwargs):
+        super().__init__(limit=limit, **kwargs)
+        self._connector_init.update(
+            keepalive_timeout=keepalive_timeout,
+            ttl_dns_cache=dns_cache_seconds,
+        )
+        self.counters = Counter()
+        self._instrumented = None
+
+    def _trace_config(self):
+        trace = aiohttp.TraceConfig()
+
+        async def count(name, *args):
+            self.counters[name] += 1
+
+        trace.on_request_start.append(functools.partial(count, "requests"))
+        trace.on_connection_create_end.append(
+            functools.partial(count, "connections_created"))
+        trace.on_connection_reuseconn.append(
+            functools.partial(count, "connections_reused"))
+        trace.on_dns_cache_hit.append(functools.partial(count, "dns_cache_hits"))
+        trace.on_dns_cache_miss.append(
+            functools.partial(count, "dns_cache_misses"))
+        trace.freeze()
+        return trace
+
+    async def create_session(self):
+        session = await super().create_session()
+        # aiogram builds the ClientSession itself; attach the metrics trace once per session
+        if session is not self._instrumented:
+            session._trace_configs.append(self._trace_config())
+            self._instrumented = session
+        return session
+
+    def stats(self):
+        stats = dict(self.counters)
+        stats["pool_limit"] = self._connector_init.get("limit")
+        connector = self._session.connector if self._session else None
+        if connector is not None and not connector.closed:
+            stats["open_connections"] = sum(
+                len(conns) for conns in connector._conns.values())
+        return stats
+
+
+class PooledHttpAdapter(HTTPAdapter):
+    def stats(self):
+        created = requests_made = 0
+        pools = self.poolmanager.pools
+        for key in pools.keys():
+            pool = pools[key]
+            created += pool.num_connections
+            requests_made += pool.num_requests
+        return {
+            "requests": requests_made,
+            "connections_created": created,
+            "connections_reused": max(requests_made - created, 0),
+        }
+
+
+# Stand-in for PooledHttpAdapter when huggingface_hub manages its own client
+class UnpooledHttp:
+    def stats(self):
+        return {"pooled": False}
+
+
+# Make huggingface_hub (used by HuggingFaceHub) reuse one connection pool;
+# each thread gets its own Session, all mounted on the shared adapter
+def configure_hf_http(pool_size=10):
+    if configure_http_backend is None:
+        logging.warning(
+            "This huggingface_hub release has no configure_http_backend; "
+            "Hugging Face calls use its default HTTP client")
+        return UnpooledHttp()
+    adapter = PooledHttpAdapter(
+        pool_connections=pool_size, pool_maxsize=pool_size)
+
+    def backend_factory():
+        session = requests.Session()
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    configure_http_backend(backend_factory=backend_factory)
+    return adapter
+
+
+class SdkExecutor:
+    def __init__(self, max_workers=8):
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="sdk")
+        self._lock = threading.Lock()
+        self.queued = 0
+        self.active = 0
+        self.peak_active = 0
+        self.completed = 0
+        self.saturated = 0  # calls that had to wait for a free thread
+        self.queue_wait_total = 0.0
+
+    def _wrap(self, func, submitted):
+        def call():
+            started = time.monotonic()
+            with self._lock:
+                self.queued -= 1
+                self.active += 1
+                self.peak_active = max(self.peak_active, self.active)
+                self.queue_wait_total += started - submitted
+            try:
+                return func()
+            finally:
+                with self._lock:
+                    self.active -= 1
+                    self.completed += 1
+        return call
+
+    # Run a blocking callable on the SDK pool (like asyncio.to_thread)
+    async def run(self, func, *args, **kwargs):
+        with self._lock:
+            if self.active + self.queued >= self.max_workers:
+                self.saturated += 1
+            self.queued += 1
+        call = self._wrap(functools.partial(
+            func, *args, **kwargs), time.monotonic())
+        return await asyncio.get_running_loop().run_in_executor(self._executor, call)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "max_workers": self.max_workers,
+                "active": self.active,
+                "queued": self.queued,
+                "peak_active": self.peak_active,
+                "completed": self.completed,
+                "saturated_calls": self.saturated,
+                "avg_queue_wait_ms": round(self.queue_wait_total / self.completed * 1000, 1) if self.completed else 0.0,
+            }
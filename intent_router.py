@@ -0,0 +1,212 @@
+import logging
+import re
+from collections import Counter
+
+import numpy as np
+
+# Local intent routing: answers greetings, thanks and help/FAQ questions from
+# canned templates without calling any language model.
+# Tier 1: one compiled regex over all intent keywords (single pass per message)
+# Tier 2: nearest-neighbour over embeddings of a curated Georgian/English example set,
+#         enabled only if it passes a small labelled check (INTENT_VALIDATION)
+# Both tiers only look at short messages; longer ones are real questions.
+
+# Phrases addressed to the bot itself. They only match when the message is the
+# phrase, optionally after a greeting ("hey, what can you do?"); a phrase
+# followed by anything else is a real question. A trailing "*" marks a stem
+# that may be followed by an inflection (Georgian suffixes).
+KEYWORD_INTENTS = {
+    "features": ["შენი ფუნქციებ*", "რა ფუნქციები გაქვს", "შენი შესაძლებლობებ*", "რას აკეთებ",
+                 "რა შეგიძლია", "what can you do", "your features", "what do you support"],
+    "help": ["როგორ გამოგიყენო", "როგორ გამოვიყენო ეს ბოტი", "how do i use this bot",
+             "how do i use you"],
+}
+
+# Whole-message intents: only match when the message is nothing but the phrase
+WHOLE_MESSAGE_INTENTS = {
+    "greeting": ["გამარჯობა", "გაგიმარჯოს", "სალამი", "hello", "hi", "hey", "good morning", "დილა მშვიდობისა"],
+    "thanks": ["მადლობა", "დიდი მადლობა", "გმადლობთ", "მადლობთ", "thanks", "thank you", "thx"],
+    "help": ["დახმარება", "მჭირდება დახმარება", "დამეხმარე", "help", "help me", "i need help"],
+    "features": ["ფუნქციები", "შესაძლებლობები", "features"],
+}
+
+# Curated examples for the embedding classifier
+INTENT_EXAMPLES = {
+    "help": [
+        "როგორ გამოვიყენო ეს ბოტი?",
+        "რა უნდა გავაკეთო?",
+        "მჭირდება დახმარება",
+        "how do I use this bot?",
+        "how does this work?",
+    ],
+    "features": [
+        "რისი გაკეთება შეგიძლია?",
+        "რა ტიპის შეტყობინებებს ამუშავებ?",
+        "შეგიძლია სურათების აღწერა?",
+        "ხმოვან შეტყობინებებს თუ ამუშავებ?",
+        "what kind of files do you support?",
+        "can you read images or voice messages?",
+    ],
+    "greeting": [
+        "გამარჯობა, როგორ ხარ?",
+        "სალამი!",
+        "hello there",
+        "hi, how are you?",
+    ],
+    "thanks": [
+        "დიდი მადლობა დახმარებისთვის",
+        "მადლობა, ძალიან დამეხმარე",
+        "thanks a lot",
+        "thank you, that helped",
+    ],
+}
+
+# Labelled messages the embedding classifier must get right before it is
+# enabled; None means "not an intent, send it to the model"
+INTENT_VALIDATION = [
+    ("როგორ მუშაობს ეს ბოტი?", "help"),
+    ("what can this bot do for me?", "features"),
+    ("გამარჯობა, რა ხდება?", "greeting"),
+    ("მადლობა, ძალიან კარგი პასუხი იყო", "thanks"),
+    ("Is this helpful?", None),
+    ("help me write an essay about WW2", None),
+    ("What are the new features in Python 3.13?", None),
+    ("რას აკეთებს ფოტოსინთეზი?", None),
+    ("რა არის ფუნქცია მათემატიკაში?", None),
+    ("როგორ მოვამზადო ხაჭაპური?", None),
+    ("translate this to English please", None),
+    ("რა ამინდია თბილისში?", None),
+    ("how does a neural network work?", None),
+    ("დამიწერე ლექსი შემოდგომაზე", None),
+    ("what can you do about my tax return?", None),
+    ("Hey, what can you do to fix this python error?", None),
+    ("რა შეგიძლია მითხრა პარიზზე?", None),
+    ("რას აკეთებ ხვალ?", None),
+]
+# Share of validation messages the classifier may misroute
+MAX_VALIDATION_ERRORS = 0.0
+
+# Messages longer than this are never treated as canned intents
+MAX_CLASSIFIER_CHARS = 80
+
+
+def _keyword_pattern(word):
+    if word.endswith("*"):
+        return rf"{re.escape(word[:-1])}\w*"
+    return re.escape(word)
+
+
+class IntentRouter:
+    def __init__(self, templates, embeddings=None, threshold=0.82):
+        self.templates = templates
+        self.embeddings = embeddings
+        self.threshold = threshold
+        greetings = "|".join(re.escape(word) for word in sorted(
+            WHOLE_MESSAGE_INTENTS["greeting"], key=len, reverse=True))
+        self._keyword_re = re.compile(rf"^\W*(?:(?:{greetings})\W+)?(?:" + "|".join(
+            f"(?P<{intent}>{'|'.join(_keyword_pattern(word) for word in sorted(words, key=len, reverse=True))})"
+            for intent, words in KEYWORD_INTENTS.items()) + r")\W*$")
+        self._whole_re = re.compile(r"^\W*(?:" + "|".join(
+            f"(?P<{intent}>{'|'.join(re.escape(word) for word in sorted(words, key=len, reverse=True))})"
+            for intent, words in WHOLE_MESSAGE_INTENTS.items()) + r")\W*$")
+        self._example_labels = None
+        self._example_matrix = None
+        self.validation = None
+        self.total = 0
+        self.routed = Counter()
+
+    # Embed the curated examples once (blocking; call from a worker thread)
+    def prepare(self):
+        if self.embeddings is None or self._example_matrix is not None:
+            return
+        labels, texts = [], []
+        for intent, examples in INTENT_EXAMPLES.items():
+            for example in examples:
+                labels.append(intent)
+                texts.append(example)
+        try:
+            matrix = np.asarray(
+                self.embeddings.embed_documents(texts), dtype=np.float32)
+        except Exception as e:
+            logging.error(f"Intent classifier initialisation failed: {e}")
+            self.embeddings = None
+            return
+        matrix /= np.linalg.norm(matrix, axis=1, keepdims=True) + 1e-12
+        self._example_labels = labels
+        self._example_matrix = matrix
+        self._validate()
+
+    # Run the labelled check; keep the classifier only if it misroutes no more
+    # than MAX_VALIDATION_ERRORS of the messages
+    def _validate(self):
+        errors = []
+        for text, expected in INTENT_VALIDATION:
+            intent, score = self.classify(text)
+            if score < self.threshold:
+                intent = None
+            if intent != expected:
+                errors.append((text, expected, intent, round(score, 3)))
+        self.validation = {
+            "checked": len(INTENT_VALIDATION),
+            "errors": len(errors),
+        }
+        if len(errors) > MAX_VALIDATION_ERRORS * len(INTENT_VALIDATION):
+            logging.warning(
+                f"Intent classifier disabled: {len(errors)}/{len(INTENT_VALIDATION)} "
+                f"validation messages misrouted at threshold {self.threshold}: {errors}")
+            self._example_matrix = None
+            self.validation["enabled"] = False
+        else:
+            self.validation["enabled"] = True
+
+    def match_keywords(self, text):
+        lowered = text.lower().strip()
+        if len(lowered) > MAX_CLASSIFIER_CHARS:
+            return None
+        whole = self._whole_re.match(lowered)
+        if whole:
+            return whole.lastgroup
+        found = self._keyword_re.match(lowered)
+        if found:
+            return found.lastgroup
+        return None
+
+    def classify(self, text):
+        if self._example_matrix is None or len(text) > MAX_CLASSIFIER_CHARS:
+            return None, 0.0
+        vector = np.asarray(self.embeddings.embed_query(
+            text.lower()), dtype=np.float32)
+        vector /= np.linalg.norm(vector) + 1e-12
+        scores = self._example_matrix @ vector
+        best = int(np.argmax(scores))
+        return self._example_labels[best], float(scores[best])
+
+    # Return (intent, answer) for messages that can be answered locally, else (None, None).
+    # Blocking when the classifier runs; call from a worker thread.
+    def route(self, text):
+        self.total += 1
+        if not text:
+            return None, None
+        intent = self.match_keywords(text)
+        if intent is None:
+            try:
+                intent, score = self.classify(text)
+            except Exception as e:
+                logging.warning(f"Intent classification failed: {e}")
+                intent, score = None, 0.0
+            if score < self.threshold:
+                intent = None
+        if intent is None or intent not in self.templates:
+            return None, None
+        self.routed[intent] += 1
+        return intent, self.templates[intent]
+
+    def stats(self):
+        routed = sum(self.routed.values())
+        return {
+            "messages": self.total,
+            "answered_locally": routed,
+            "local_share": round(routed / self.total, 3) if self.total else 0.0,
+            "by_intent": dict(self.routed),
+            "classifier_validation": self.validation,
+        }
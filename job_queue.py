@@ -0,0 +1,215 @@
+import asyncio
+import json
+import logging
+import pathlib
+import sqlite3
+import threading
+import time
+from collections import Counter
+
+# Persistent background job queue for heavy media work.
+# Jobs are stored in SQLite so they survive restarts: anything still "running"
+# when the bot stopped goes back to "pending" on the next start. A fixed pool
+# of asyncio workers claims jobs by priority (lower value first), then age.
+# A handler that raises is retried with exponential backoff, up to
+# max_attempts; the payload it receives carries "attempt" and "last_attempt"
+# so it can decide when to give up and tell the user. Raising JobFailed marks
+# the job failed without further attempts.
+
+# Priority classes
+PRIORITY_INTERACTIVE = 0  # short, conversational work (voice messages)
+PRIORITY_MEDIA = 10       # images
+PRIORITY_BULK = 20        # documents and other large files
+
+# Delay before retry n is RETRY_BASE_SECONDS * 2**(n-1), capped
+RETRY_BASE_SECONDS = 5
+RETRY_MAX_SECONDS = 300
+
+
+
+# Raised by a handler that has given up on its job (and already told the user)
+class JobFailed(Exception):
+    pass
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    priority INTEGER NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    created REAL NOT NULL,
+    updated REAL NOT NULL,
+    available REAL NOT NULL DEFAULT 0
+);
+"""
+
+
+class JobQueue:
+    def __init__(self, db_path, workers=4, max_attempts=3):
+        self.db_path = pathlib.Path(db_path)
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self._handlers = {}
+        self._tasks = []
+        self._wakeup = None
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            str(self.db_path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")]
+        if "available" not in columns:
+            self._conn.execute(
+                "ALTER TABLE jobs ADD COLUMN available REAL NOT NULL DEFAULT 0")
+        self._conn.execute("DROP INDEX IF EXISTS idx_jobs_claim")
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_jobs_pending ON jobs (status, priority, id, available)")
+        self._conn.commit()
+        self.counters = Counter()
+        self.busy_workers = 0
+
+    # Register the coroutine function that processes jobs of `kind`;
+    # it is called with the job payload (a dict)
+    def register(self, kind, handler):
+        self._handlers[kind] = handler
+
+    def enqueue(self, kind, payload, priority=PRIORITY_MEDIA):
+        now = time.time()
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "INSERT INTO jobs (kind, priority, payload, created, updated) VALUES (?, ?, ?, ?, ?)",
+                (kind, priority, json.dumps(payload, ensure_ascii=False), now, now))
+        self.counters["enqueued"] += 1
+        if self._wakeup:
+            self._wakeup.set()
+        return cursor.lastrowid
+
+    def _claim(self):
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT id, kind, payload, attempts, created FROM jobs "
+                "WHERE status = 'pending' AND available <= ? ORDER BY priority, id LIMIT 1",
+                (time.time(),)).fetchone()
+            if row is None:
+                return None
+            self._conn.execute(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1, updated = ? WHERE id = ?",
+                (time.time(), row[0]))
+        job_id, kind, payload, attempts, created = row
+        self.counters["wait_seconds_total"] += time.time() - created
+        return job_id, kind, json.loads(payload), attempts + 1
+
+    def _finish(self, job_id, status, error=None, delay=0):
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, updated = ?, available = ? WHERE id = ?",
+                (status, error, now, now + delay, job_id))
+
+    # Seconds until the next delayed retry becomes claimable, or None
+    def _next_retry_in(self):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT MIN(available) FROM jobs WHERE status = 'pending'").fetchone()
+        if row[0] is None:
+            return None
+        return max(row[0] - time.time(), 0.1)
+
+    # Put jobs interrupted by a restart back in the queue
+    def _resume(self):
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET status = 'pending' WHERE status = 'running'")
+        if cursor.rowcount:
+            logging.info(f"Resuming {cursor.rowcount} interrupted jobs")
+        self.counters["resumed"] += cursor.rowcount
+
+    # Drop finished jobs older than `max_age` seconds
+    def purge(self, max_age=24 * 3600):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "DELETE FROM jobs WHERE status IN ('done', 'failed') AND updated < ?",
+                (time.time() - max_age,))
+
+    async def _worker(self):
+        while True:
+            job = self._claim()
+            if job is None:
+                self._wakeup.clear()
+                # Re-check after clearing so an enqueue in between is not missed
+                job = self._claim()
+                if job is None:
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), self._next_retry_in())
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+            job_id, kind, payload, attempts = job
+            handler = self._handlers.get(kind)
+            if handler is None:
+                logging.error(f"No handler registered for job kind '{kind}'")
+                self._finish(job_id, "failed", "no handler")
+                self.counters["failed"] += 1
+                continue
+            self.busy_workers += 1
+            try:
+                await handler({**payload, "attempt": attempts,
+                               "last_attempt": attempts >= self.max_attempts})
+                self._finish(job_id, "done")
+                self.counters["done"] += 1
+            except asyncio.CancelledError:
+                # Shutting down: leave the job as running so it is resumed on restart
+                raise
+            except Exception as e:
+                if isinstance(e, JobFailed) or attempts >= self.max_attempts:
+                    logging.error(
+                        f"Job {job_id} ({kind}) failed on attempt {attempts}: {e}", exc_info=True)
+                    self._finish(job_id, "failed", str(e))
+                    self.counters["failed"] += 1
+                else:
+                    delay = min(RETRY_BASE_SECONDS * 2 ** (attempts - 1), RETRY_MAX_SECONDS)
+                    logging.warning(
+                        f"Job {job_id} ({kind}) failed on attempt {attempts}, retrying in {delay}s: {e}")
+                    self._finish(job_id, "pending", str(e), delay=delay)
+                    self.counters["retried"] += 1
+            finally:
+                self.busy_workers -= 1
+
+    def start(self):
+        self._wakeup = asyncio.Event()
+        self._resume()
+        self.purge()
+        self._tasks = [asyncio.create_task(self._worker())
+                       for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        with self._lock:
+            self._conn.close()
+
+    def stats(self):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT status, priority, COUNT(*) FROM jobs GROUP BY status, priority").fetchall()
+        stats = {
+            "workers": self.workers,
+            "busy_workers": self.busy_workers,
+            "pending_by_priority": {priority: count for status, priority, count in rows if status == "pending"},
+            "running": sum(count for status, _, count in rows if status == "running"),
+        }
+        stats.update(self.counters)
+        wait_total = stats.pop("wait_seconds_total", 0)
+        claimed = self.counters["done"] + self.counters["failed"] + \
+            self.counters["retried"]
+        if claimed:
+            stats["avg_wait_seconds"] = round(
+                wait_total / claimed, 2)
+        return stats
@@ -0,0 +1,232 @@
+import asyncio
+import logging
+import time
+from collections import Counter, deque
+
+from google.api_core import exceptions as api_exceptions
+from googleapiclient.errors import HttpError
+
+from genai_compat import GenaiKeyClient, check_sdk
+from prompt_budget import estimate_tokens
+
+# Gemini key/model pool with load-aware routing.
+# Every (API key, model) pair is a slot with its own SDK clients (see
+# genai_compat), since genai.configure() only holds one global key. A request
+# is routed to a tier ("fast" for small inputs, "strong" for large media), then
+# to the least loaded slot of that tier. Throttled slots cool down and the request fails over to
+# the next slot.
+# Static system prompts are sent as the model's system instruction, so the
+# request starts with an identical prefix the backend can cache implicitly.
+# Prompts long enough for explicit context caching are uploaded once per slot
+# as cached content and reused until the cache TTL runs out.
+
+TIER_FAST = "fast"
+TIER_STRONG = "strong"
+
+# Errors that mean "this key/model is out of quota right now"
+THROTTLE_ERRORS = (
+    api_exceptions.ResourceExhausted,
+    api_exceptions.TooManyRequests,
+    api_exceptions.ServiceUnavailable,
+)
+# File uploads go through the discovery client (googleapiclient), which
+# raises HttpError instead of api_core exceptions
+THROTTLE_STATUSES = (429, 503)
+
+
+def is_throttle_error(error):
+    if isinstance(error, THROTTLE_ERRORS):
+        return True
+    return isinstance(error, HttpError) and int(getattr(error.resp, "status", 0) or 0) in THROTTLE_STATUSES
+
+
+class ModelSlot:
+    def __init__(self, api_key, model_name, rpm_limit=0, cache_min_tokens=1024, cache_ttl=3600):
+        self.key_id = f"...{api_key[-4:]}"
+        self.model_name = model_name
+        self.rpm_limit = rpm_limit
+        self.cache_min_tokens = cache_min_tokens
+        self.cache_ttl = cache_ttl
+        # Files uploaded with one key are only visible to that key, so uploads,
+        # generation and deletion for a request all go through the same slot.
+        # The same goes for cached contents.
+        self.client = GenaiKeyClient(api_key)
+        self.model = self.client.model(model_name)
+        self._prompt_models = {}  # system prompt -> (model, cache expiry or None)
+        self._cache_lock = asyncio.Lock()
+        self.in_flight = 0
+        self.latency = None  # exponentially weighted moving average, seconds
+        self.cooldown_until = 0.0
+        self.recent = deque()  # request start times within the last minute
+        self.counters = Counter()
+
+    def upload_file(self, path, display_name, mime_type):
+        return self.client.upload_file(path, display_name, mime_type)
+
+    def delete_file(self, name):
+        self.client.delete_file(name)
+
+    # The model to use for a static system prompt: explicit cached content when
+    # the prompt is long enough and the backend accepts it, otherwise a model
+    # carrying the prompt as its system instruction
+    async def _model_for(self, system_instruction):
+        entry = self._prompt_models.get(system_instruction)
+        if entry and (entry[1] is None or time.monotonic() < entry[1]):
+            return entry[0]
+        async with self._cache_lock:
+            entry = self._prompt_models.get(system_instruction)
+            if entry and (entry[1] is None or time.monotonic() < entry[1]):
+                return entry[0]
+            if estimate_tokens(system_instruction) >= self.cache_min_tokens:
+                try:
+                    model = await self.client.cached_model(
+                        self.model_name, system_instruction, self.cache_ttl)
+                    # Refresh a minute early so requests never hit an expired cache
+                    expires = time.monotonic() + max(self.cache_ttl - 60, 60)
+                    self._prompt_models[system_instruction] = (model, expires)
+                    self.counters["prompt_caches_created"] += 1
+                    return model
+                except api_exceptions.GoogleAPIError as e:
+                    logging.warning(
+                        f"Context caching unavailable for {self.model_name} ({self.key_id}): {e}")
+                    self.counters["prompt_cache_failures"] += 1
+            model = self.client.model(
+                self.model_name, system_instruction=system_instruction)
+            self._prompt_models[system_instruction] = (model, None)
+            return model
+
+    async def generate_content_async(self, contents, system_instruction=None):
+        if not system_instruction:
+            return await self.model.generate_content_async(contents)
+        model = await self._model_for(system_instruction)
+        try:
+            return await model.generate_content_async(contents)
+        except api_exceptions.NotFound:
+            if not model.cached_content:
+                raise
+            # The cached content was evicted early; rebuild it on the next call
+            self._prompt_models.pop(system_instruction, None)
+            model = await self._model_for(system_instruction)
+            return await model.generate_content_async(contents)
+
+    def available(self, now):
+        if now < self.cooldown_until:
+            return False
+        while self.recent and now - self.recent[0] > 60:
+            self.recent.popleft()
+        return not self.rpm_limit or len(self.recent) < self.rpm_limit
+
+    # Lower is better: expected wait given current load and observed latency
+    def load_score(self):
+        return (self.in_flight + 1) * (self.latency or 1.0)
+
+    def record(self, seconds):
+        self.latency = seconds if self.latency is None else 0.8 * \
+            self.latency + 0.2 * seconds
+
+    def stats(self):
+        return {
+            "model": self.model_name,
+            "in_flight": self.in_flight,
+            "latency_ms": round(self.latency * 1000) if self.latency else None,
+            "requests_last_minute": len(self.recent),
+            "cooling_down": time.monotonic() < self.cooldown_until,
+            **self.counters,
+        }
+
+
+class ModelPool:
+    def __init__(self, api_keys, fast_model, strong_model=None, rpm_limit=0,
+                 cooldown=60, strong_min_bytes=2 * 1024 * 1024, cache_min_tokens=1024,
+                 cache_ttl=3600):
+        # Fail at startup, not on the first request, if the SDK has changed;
+        # an empty pool (text-only deployment) never touches the SDK
+        if api_keys:
+            check_sdk()
+        self.tiers = {TIER_FAST: fast_model,
+                      TIER_STRONG: strong_model or fast_model}
+        self.cooldown = cooldown
+        self.strong_min_bytes = strong_min_bytes
+        self.slots = [
+            ModelSlot(api_key, model_name, rpm_limit,
+                      cache_min_tokens=cache_min_tokens, cache_ttl=cache_ttl)
+            for api_key in api_keys
+            for model_name in dict.fromkeys(self.tiers.values())
+        ]
+        self.counters = Counter()
+
+    def __bool__(self):
+        return bool(self.slots)
+
+    # Pick the model tier for an input of the given size
+    def tier_for(self, size_bytes=0):
+        if size_bytes and size_bytes >= self.strong_min_bytes:
+            return TIER_STRONG
+        return TIER_FAST
+
+    def _choose(self, tier, exclude):
+        now = time.monotonic()
+        candidates = [slot for slot in self.slots
+                      if slot not in exclude and slot.available(now)]
+        preferred = [slot for slot in candidates
+                     if slot.model_name == self.tiers[tier]]
+        if preferred:
+            return min(preferred, key=ModelSlot.load_score)
+        if candidates:
+            # Every key for this tier is throttled; use the other tier instead
+            self.counters["tier_fallbacks"] += 1
+            return min(candidates, key=ModelSlot.load_score)
+        return None
+
+    async def _acquire(self, tier, exclude):
+        while True:
+            slot = self._choose(tier, exclude)
+            if slot is not None:
+                return slot
+            remaining = [slot for slot in self.slots if slot not in exclude]
+            if not remaining:
+                return None
+            # All slots are cooling down or at their request limit: wait for the first one
+            now = time.monotonic()
+            wait = min(max(slot.cooldown_until - now,
+                           60 - (now - slot.recent[0]) if slot.recent else 0, 0.1)
+                       for slot in remaining)
+            self.counters["waits"] += 1
+            await asyncio.sleep(min(wait, 5))
+
+    # Run `work(slot)` on the best slot for `tier`, failing over to other
+    # slots when a key is throttled
+    async def run(self, tier, work):
+        tried = set()
+        last_error = None
+        while True:
+            slot = await self._acquire(tier, tried)
+            if slot is None:
+                raise last_error or RuntimeError("No Gemini API keys configured")
+            tried.add(slot)
+            slot.in_flight += 1
+            slot.recent.append(time.monotonic())
+            slot.counters["requests"] += 1
+            self.counters[f"{tier}_requests"] += 1
+            started = time.monotonic()
+            try:
+                result = await work(slot)
+                slot.record(time.monotonic() - started)
+                return result
+            except Exception as e:
+                if not is_throttle_error(e):
+                    raise
+                slot.cooldown_until = time.monotonic() + self.cooldown
+                slot.counters["throttled"] += 1
+                self.counters["failovers"] += 1
+                logging.warning(
+                    f"Gemini key {slot.key_id} ({slot.model_name}) throttled, failing over: {e}")
+                last_error = e
+            finally:
+                slot.in_flight -= 1
+
+    def stats(self):
+        stats = dict(self.counters)
+        for slot in self.slots:
+            stats[f"{slot.key_id}/{slot.model_name}"] = slot.stats()
+        return stats
@@ -0,0 +1,265 @@
+import asyncio
+import logging
+import re
+import time
+from collections import Counter
+
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+
+# Outbound delivery: every message sent, edited or deleted by the handlers goes
+# through OutboundSender, which
+# - paces calls with a global and a per-chat token bucket (Telegram flood limits)
+# - waits and retries when Telegram answers with RetryAfter
+# - splits long HTML responses into ordered parts under the 4096 character limit
+# - turns "delete placeholder + send answer" into a single edit where possible
+
+TELEGRAM_MESSAGE_LIMIT = 4096
+MAX_RETRIES = 3
+
+# Tags, entities, newlines and words; a word keeps its trailing spaces but
+# never the newline, so every line break is a token of its own
+_TOKEN_RE = re.compile(
+    r"<[^>]*>|&#?\w+;|\n|[^<&\n]{1,500}?(?=\s|<|&|$)[^\S\n]*|[^<&\n]{1,500}")
+_SENTENCE_END_RE = re.compile(r"[.!?…][\"')\]]*\s+$")
+_TAG_RE = re.compile(r"<\s*(/)?\s*([a-zA-Z0-9-]+)[^>]*?(/)?\s*>")
+
+
+def telegram_length(text):
+    # Telegram counts message length in UTF-16 code units
+    return len(text.encode("utf-16-le")) // 2
+
+
+def _closing(stack):
+    return "".join(f"</{name}>" for name, _ in reversed(stack))
+
+
+def _reopening(stack):
+    return "".join(tag for _, tag in stack)
+
+
+def _apply_tag(stack, token):
+    tag = _TAG_RE.match(token)
+    if not tag:
+        return stack
+    closing, name, self_closing = tag.groups()
+    name = name.lower()
+    if self_closing:
+        return stack
+    if closing:
+        for i in range(len(stack) - 1, -1, -1):
+            if stack[i][0] == name:
+                return stack[:i] + stack[i + 1:]
+        return stack
+    return stack + [(name, token)]
+
+
+# Split an HTML message into parts that each fit the Telegram limit. Cuts prefer
+# line breaks, then sentence ends, then word boundaries; they never land inside
+# a tag or entity, and tags open at a cut are closed at the end of one part and
+# reopened at the start of the next.
+def split_html(text, limit=TELEGRAM_MESSAGE_LIMIT):
+    if telegram_length(text) <= limit:
+        return [text]
+    parts = []
+    current, stack, length = [], [], 0
+    # (index in current, stack, length) after the last newline / sentence end
+    last_break = last_sentence = None
+
+    def emit(tokens, open_stack):
+        body = "".join(tokens).strip()
+        if body and body != _reopening(open_stack).strip():
+            parts.append(body + _closing(open_stack))
+
+    for token in _TOKEN_RE.findall(text):
+        new_stack = _apply_tag(stack, token) if token.startswith("<") else stack
+        token_length = telegram_length(token)
+        if current and length + token_length + telegram_length(_closing(new_stack)) > limit:
+            cut = next((point for point in (last_break, last_sentence)
+                        if point and point[1] > length // 2), None)
+            if cut:
+                index, break_stack = cut[0], cut[2]
+                emit(current[:index], break_stack)
+                carry = current[index:]
+                current = [_reopening(break_stack)]
+                stack = break_stack
+                for carried in carry:
+                    current.append(carried)
+                    if carried.startswith("<"):
+                        stack = _apply_tag(stack, carried)
+            else:
+                emit(current, stack)
+                current = [_reopening(stack)]
+            length = sum(telegram_length(piece) for piece in current)
+            last_break = last_sentence = None
+            new_stack = _apply_tag(stack, token) if token.startswith("<") else stack
+        current.append(token)
+        stack = new_stack
+        length += token_length
+        if token == "\n":
+            last_break = (len(current), length, stack)
+        elif _SENTENCE_END_RE.search(token):
+            last_sentence = (len(current), length, stack)
+    emit(current, stack)
+    return parts
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens +
+                          (now - self.updated) * self.rate)
+        self.updated = now
+
+    # Wait for a token; returns the seconds spent waiting
+    async def acquire(self):
+        waited = 0.0
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                delay = (1 - self.tokens) / self.rate
+                waited += delay
+                await asyncio.sleep(delay)
+
+    def idle(self):
+        self._refill()
+        return self.tokens >= self.burst and not self._lock.locked()
+
+
+class OutboundSender:
+    def __init__(self, global_rate=25, chat_rate=1.0, chat_burst=3):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self._chat_buckets = {}
+        # Per-chat lock keeps the parts of one reply (and replies to one chat) in order
+        self._chat_locks = {}
+        self.counters = Counter()
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) > 10000:
+                self._prune()
+            bucket = TokenBucket(self.chat_rate, self.chat_burst)
+            self._chat_buckets[chat_id] = bucket
+        return bucket
+
+    def _prune(self):
+        for chat_id, bucket in list(self._chat_buckets.items()):
+            lock = self._chat_locks.get(chat_id)
+            if bucket.idle() and not (lock and lock.locked()):
+                del self._chat_buckets[chat_id]
+                self._chat_locks.pop(chat_id, None)
+
+    def _chat_lock(self, chat_id):
+        lock = self._chat_locks.get(chat_id)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._chat_locks[chat_id] = lock
+        return lock
+
+    # Run one Telegram API call under both buckets, retrying on flood control
+    async def _call(self, chat_id, kind, make_call):
+        for attempt in range(MAX_RETRIES + 1):
+            waited = await self._chat_bucket(chat_id).acquire()
+            waited += await self.global_bucket.acquire()
+            if waited:
+                self.counters["throttled"] += 1
+            try:
+                result = await make_call()
+                self.counters["api_calls"] += 1
+                self.counters[kind] += 1
+                return result
+            except TelegramRetryAfter as e:
+                self.counters["retry_after"] += 1
+                if attempt == MAX_RETRIES:
+                    raise
+                logging.warning(
+                    f"Flood control in chat {chat_id}, retrying in {e.retry_after}s")
+                await asyncio.sleep(e.retry_after)
+
+    # Send `text` (split into parts if needed) with `send(part)`. When `edit` is
+    # given, the first part replaces the placeholder message instead of deleting
+    # it and sending a new one.
+    async def _deliver(self, chat_id, text, send, edit=None, delete=None):
+        parts = split_html(text)
+        if len(parts) > 1:
+            self.counters["split_messages"] += 1
+        async with self._chat_lock(chat_id):
+            if edit is None:
+                sent = await self._call(chat_id, "sent", lambda: send(parts[0]))
+            else:
+                try:
+                    sent = await self._call(chat_id, "edited", lambda: edit(parts[0]))
+                    self.counters["collapsed_replies"] += 1
+                except TelegramBadRequest as e:
+                    # e.g. the placeholder was already deleted; fall back to delete + send
+                    logging.warning(
+                        f"Placeholder edit failed in chat {chat_id}: {e}")
+                    try:
+                        await self._call(chat_id, "deleted", delete)
+                    except TelegramBadRequest:
+                        pass
+                    sent = await self._call(chat_id, "sent", lambda: send(parts[0]))
+            for part in parts[1:]:
+                sent = await self._call(chat_id, "sent", lambda part=part: send(part))
+        return sent
+
+    async def _edit(self, chat_id, edit):
+        async with self._chat_lock(chat_id):
+            return await self._call(chat_id, "edited", edit)
+
+    async def answer(self, message, text, **kwargs):
+        return await self._deliver(
+            message.chat.id, text, lambda part: message.answer(part, **kwargs))
+
+    async def edit(self, message, text, **kwargs):
+        return await self._edit(message.chat.id, lambda: message.edit_text(text, **kwargs))
+
+    async def delete(self, message):
+        chat_id = message.chat.id
+        async with self._chat_lock(chat_id):
+            try:
+                return await self._call(chat_id, "deleted", message.delete)
+            except TelegramBadRequest as e:
+                logging.warning(f"Could not delete message in chat {chat_id}: {e}")
+
+    # Deliver `text` as the reply to `message`, replacing `placeholder` if given
+    async def reply(self, message, text, placeholder=None, **kwargs):
+        if placeholder is None:
+            return await self.answer(message, text, **kwargs)
+        return await self._deliver(
+            message.chat.id, text,
+            send=lambda part: message.answer(part, **kwargs),
+            edit=lambda part: placeholder.edit_text(part, **kwargs),
+            delete=placeholder.delete)
+
+    # Chat-id based variants, for work that outlives the original Message object
+    # (e.g. background jobs resumed after a restart)
+    async def reply_in_chat(self, bot, chat_id, text, placeholder_id=None, **kwargs):
+        if placeholder_id is None:
+            return await self._deliver(
+                chat_id, text, lambda part: bot.send_message(chat_id, part, **kwargs))
+        return await self._deliver(
+            chat_id, text,
+            send=lambda part: bot.send_message(chat_id, part, **kwargs),
+            edit=lambda part: bot.edit_message_text(
+                part, chat_id=chat_id, message_id=placeholder_id, **kwargs),
+            delete=lambda: bot.delete_message(chat_id, placeholder_id))
+
+    async def edit_in_chat(self, bot, chat_id, message_id, text, **kwargs):
+        return await self._edit(chat_id, lambda: bot.edit_message_text(
+            text, chat_id=chat_id, message_id=message_id, **kwargs))
+
+    def stats(self):
+        return dict(self.counters)
@@ -0,0 +1,186 @@
+import math
+import time
+from collections import Counter, defaultdict
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+# Token budgeting for model prompts.
+# Text that goes into a prompt (captions, transcriptions, user questions) is
+# counted before sending and fitted to a per-handler budget: first compressed
+# (whitespace, repeated lines), then cut down to its head and tail. Every model
+# call records input/output tokens next to its latency, per handler, so cost
+# and speed can be tuned together.
+# For the RAG chain the budget covers the question and the retrieved context
+# together (BudgetedRetriever), and the prompt the chain actually assembles is
+# what gets counted (PromptCapture).
+
+# Local estimate, no API call: roughly 4 characters per token for ASCII text
+# and 2 for other scripts (Georgian tokenizes much less densely than English)
+ASCII_CHARS_PER_TOKEN = 4
+OTHER_CHARS_PER_TOKEN = 2
+
+TRUNCATION_MARKER = "\n[...]\n"
+
+
+def estimate_tokens(text):
+    if not text:
+        return 0
+    ascii_chars = len(text.encode("ascii", "ignore"))
+    other_chars = len(text) - ascii_chars
+    return math.ceil(ascii_chars / ASCII_CHARS_PER_TOKEN + other_chars / OTHER_CHARS_PER_TOKEN)
+
+
+# Collapse whitespace runs and drop consecutive repeated lines (pasted logs,
+# forwarded message chains)
+def compress_text(text):
+    lines = []
+    for line in text.splitlines():
+        line = " ".join(line.split())
+        if lines and line == lines[-1]:
+            continue
+        lines.append(line)
+    return "\n".join(lines).strip()
+
+
+# Fit text into `max_tokens`; returns (text, was_shortened). Over-long text
+# keeps its beginning and end, where captions and questions usually carry
+# the request.
+def fit_text(text, max_tokens):
+    if not text or not max_tokens or estimate_tokens(text) <= max_tokens:
+        return text, False
+    text = compress_text(text)
+    tokens = estimate_tokens(text)
+    if tokens <= max_tokens:
+        return text, True
+    keep = int(len(text) * max_tokens / tokens)
+    while keep > 0:
+        head = text[:keep * 2 // 3].rstrip()
+        tail = text[len(text) - (keep - keep * 2 // 3):].lstrip()
+        fitted = f"{head}{TRUNCATION_MARKER}{tail}"
+        if estimate_tokens(fitted) <= max_tokens:
+            return fitted, True
+        keep = int(keep * 0.9)
+    return "", True
+
+
+class PromptBudget:
+    def __init__(self, budgets):
+        self.budgets = budgets  # handler -> max tokens of free text in its prompt
+        self.counters = defaultdict(Counter)
+
+    # Count and fit the free-text part of a handler's prompt; `max_tokens`
+    # reserves part of the budget for other prompt text
+    def fit(self, handler, text, max_tokens=None):
+        fitted, shortened = fit_text(text, max_tokens or self.budgets.get(handler))
+        if shortened:
+            self.counters[handler]["shortened"] += 1
+            self.counters[handler]["tokens_saved"] += estimate_tokens(
+                text) - estimate_tokens(fitted)
+        return fitted
+
+    # Fit retrieved passages (best first) into what the question leaves of the
+    # handler's budget; the passage that crosses the limit is shortened and
+    # the rest are dropped
+    def fit_context(self, handler, question, passages):
+        budget = self.budgets.get(handler)
+        if not budget:
+            return list(passages)
+        remaining = budget - estimate_tokens(question)
+        fitted = []
+        for passage in passages:
+            if remaining <= 0:
+                break
+            text, shortened = fit_text(passage, remaining)
+            if text:
+                fitted.append(text)
+                remaining -= estimate_tokens(text)
+            if shortened:
+                break
+        dropped = sum(estimate_tokens(p) for p in passages) - sum(estimate_tokens(t) for t in fitted)
+        if dropped:
+            self.counters[handler]["context_shortened"] += 1
+            self.counters[handler]["tokens_saved"] += dropped
+        return fitted
+
+    def record(self, handler, input_tokens, output_tokens, seconds, cached_tokens=0, estimated=False):
+        counters = self.counters[handler]
+        counters["requests"] += 1
+        counters["input_tokens"] += input_tokens or 0
+        counters["output_tokens"] += output_tokens or 0
+        counters["cached_tokens"] += cached_tokens or 0
+        counters["latency_ms"] += round(seconds * 1000)
+        if estimated:
+            counters["estimated"] += 1
+
+    # Run one Gemini call on `slot` and record its token usage and latency
+    async def generate(self, slot, handler, contents, system_instruction=None):
+        started = time.monotonic()
+        response = await slot.generate_content_async(contents, system_instruction=system_instruction)
+        usage = getattr(response, "usage_metadata", None)
+        if usage:
+            self.record(handler, usage.prompt_token_count, usage.candidates_token_count,
+                        time.monotonic() - started,
+                        cached_tokens=getattr(usage, "cached_content_token_count", 0))
+        else:
+            # Estimate from the text parts when the backend reports no usage
+            parts = contents if isinstance(contents, list) else [contents]
+            texts = [part for part in [system_instruction, *parts]
+                     if isinstance(part, str)]
+            output_text = ""
+            try:
+                output_text = response.text or ""
+            except ValueError:
+                pass
+            self.record(handler, sum(estimate_tokens(text) for text in texts),
+                        estimate_tokens(output_text), time.monotonic() - started, estimated=True)
+        return response
+
+    def stats(self):
+        stats = {}
+        for handler, counters in self.counters.items():
+            requests = counters["requests"]
+            handler_stats = {"budget_tokens": self.budgets.get(handler), **counters}
+            if requests:
+                handler_stats.update(
+                    avg_input_tokens=round(counters["input_tokens"] / requests),
+                    avg_output_tokens=round(counters["output_tokens"] / requests),
+                    avg_latency_ms=round(counters["latency_ms"] / requests),
+                )
+            if counters["output_tokens"]:
+                handler_stats["ms_per_output_token"] = round(
+                    counters["latency_ms"] / counters["output_tokens"], 1)
+            stats[handler] = handler_stats
+        return stats
+
+
+# Retriever wrapper that fits the retrieved documents to a handler's budget
+class BudgetedRetriever(BaseRetriever):
+    retriever: BaseRetriever
+    budget: PromptBudget
+    handler: str
+
+    model_config = {"arbitrary_types_allowed": True}
+
+    def _get_relevant_documents(self, query, *, run_manager):
+        docs = self.retriever.invoke(
+            query, config={"callbacks": run_manager.get_child()})
+        texts = self.budget.fit_context(
+            self.handler, query, [doc.page_content for doc in docs])
+        return [Document(page_content=text, metadata=doc.metadata)
+                for doc, text in zip(docs, texts)]
+
+
+# Collects the prompts a chain sends to its LLM, so the assembled prompt
+# (template, retrieved context and question) can be counted
+class PromptCapture(BaseCallbackHandler):
+    def __init__(self):
+        self.prompts = []
+
+    def on_llm_start(self, serialized, prompts, **kwargs):
+        self.prompts.extend(prompts)
+
+    @property
+    def tokens(self):
+        return sum(estimate_tokens(prompt) for prompt in self.prompts)
@@ -0,0 +1,50 @@
+import asyncio
+import re
+
+# Single-flight request coalescing: concurrent calls with the same key share
+# one in-flight task instead of each doing the work. Callers that arrive while
+# the task is running attach to it; once the result is published the key is
+# released and the next call starts fresh work.
+
+
+class SingleFlight:
+    def __init__(self, name):
+        self.name = name
+        self._inflight = {}
+        self.calls = 0
+        self.leaders = 0
+        self.coalesced = 0
+
+    async def run(self, key, factory):
+        self.calls += 1
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(factory())
+            self._inflight[key] = task
+            task.add_done_callback(lambda done, key=key: self._release(key, done))
+            self.leaders += 1
+        else:
+            self.coalesced += 1
+        # Shield so that one cancelled caller does not cancel the shared work
+        return await asyncio.shield(task)
+
+    def _release(self, key, task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # Mark the exception as retrieved when every caller has gone away
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self):
+        return {
+            "calls": self.calls,
+            "executed": self.leaders,
+            "coalesced": self.coalesced,
+            "coalesce_rate": round(self.coalesced / self.calls, 3) if self.calls else 0.0,
+            "in_flight": len(self._inflight),
+        }
+
+
+# Normalise a text query so trivially different duplicates share a key
+def normalize_query(text):
+    return re.sub(r"\s+", " ", text).strip().rstrip("?!.…").strip().lower()
@@ -0,0 +1,31 @@
+import pytest
+
+from intent_router import IntentRouter, INTENT_VALIDATION
+
+
+@pytest.fixture
+def router():
+    return IntentRouter({})
+
+
+@pytest.mark.parametrize("text, intent", [
+    ("what can you do?", "features"),
+    ("Hey, what can you do?", "features"),
+    ("რა შეგიძლია?", "features"),
+    ("შენი ფუნქციები", "features"),
+    ("how do I use this bot?", "help"),
+    ("hello!", "greeting"),
+    ("მადლობა", "thanks"),
+    ("help", "help"),
+])
+def test_bot_addressed_phrases_match(router, text, intent):
+    assert router.match_keywords(text) == intent
+
+
+@pytest.mark.parametrize("text", [text for text, expected in INTENT_VALIDATION if expected is None])
+def test_questions_are_not_matched(router, text):
+    assert router.match_keywords(text) is None
+
+
+def test_long_messages_are_not_matched(router):
+    assert router.match_keywords("what can you do? " + "x" * 100) is None
@@ -0,0 +1,58 @@
+import re
+
+from outbound import split_html, telegram_length
+
+PARAGRAPHS = "\n".join(
+    f"Paragraph {n}. " + "This is a sentence about the weather. " * 6
+    for n in range(30))
+
+
+def tag_balance(part):
+    opened = re.findall(r"<(b|i|pre|code)\b[^>]*>", part)
+    closed = re.findall(r"</(b|i|pre|code)>", part)
+    return sorted(opened) == sorted(closed)
+
+
+def test_short_text_is_not_split():
+    assert split_html("hello <b>world</b>", 100) == ["hello <b>world</b>"]
+
+
+def test_parts_fit_the_limit_and_keep_all_words():
+    parts = split_html(PARAGRAPHS, 1000)
+    assert len(parts) > 1
+    assert all(telegram_length(part) <= 1000 for part in parts)
+    assert " ".join(" ".join(parts).split()) == " ".join(PARAGRAPHS.split())
+
+
+def test_cuts_land_on_line_breaks():
+    lines = {line.strip() for line in PARAGRAPHS.split("\n")}
+    for part in split_html(PARAGRAPHS, 1000):
+        assert all(line.strip() in lines for line in part.split("\n"))
+
+
+def test_cuts_prefer_sentence_ends_without_line_breaks():
+    text = "Short sentence number one. " * 100
+    for part in split_html(text, 500)[:-1]:
+        assert part.endswith(".")
+
+
+def test_tags_are_closed_and_reopened_across_parts():
+    text = "<pre>" + "\n".join(f"line {n} of code" for n in range(200)) + "</pre>"
+    parts = split_html(text, 500)
+    assert len(parts) > 1
+    for part in parts:
+        assert part.startswith("<pre>") and part.endswith("</pre>")
+        assert tag_balance(part)
+        assert telegram_length(part) <= 500
+
+
+def test_entities_are_never_cut():
+    text = "a &amp; b " * 400
+    for part in split_html(text, 300):
+        assert not re.search(r"&\w*$", part)
+        assert not re.match(r"^\w*;", part)
+
+
+def test_length_counts_utf16_units():
+    text = "😀 " * 1500
+    assert all(telegram_length(part) <= 1000 for part in split_html(text, 1000))
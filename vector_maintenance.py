@@ -0,0 +1,294 @@
+import logging
+import re
+import time
+from collections import Counter
+from datetime import datetime
+
+import numpy as np
+
+from ann_store import AnnVectorStore
+
+# Retention for the RAG corpus built from the conversation log:
+# - error and placeholder responses are never indexed
+# - near-identical Q&A pairs (cosine >= dedup_threshold) keep only the newest copy
+# - documents older than ttl_days, or the oldest beyond max_docs, are expired
+# - an empty index is filled newest-first, stopping at ttl_days or max_docs;
+#   afterwards new conversation rows are ingested incrementally and the store
+#   is compacted on a background schedule
+# Both backends get the same rules. The ANN store keeps ages and the ingestion
+# checkpoint on disk; for the in-memory Chroma backend, which is rebuilt from
+# the conversation store on every start, ChromaIndex tracks document ages in
+# memory (bounded by max_docs).
+
+# Responses log_conversation records when the bot did not actually answer
+PLACEHOLDER_RESPONSES = re.compile(
+    r"(?:სერვისი მიუწვდომელია|ტექსტი არ არის|Retrieval chain returned no result"
+    r"|სურათი/ფაილი ცარიელია|ფაილი ცარიელია|აუდიო ფაილი ცარიელია"
+    r"|სურათის აღწერა ვერ მოხერხდა|ხმოვანი შეტყობინება ვერ მოიძებნა"
+    r"|შეცდომა .{1,60} დამუშავებისას|Sent \w+ text)$"
+    r"|პასუხი ვერ გენერირდა")
+
+CHECKPOINT = "conversation_row_id"
+
+
+def is_indexable(message, response):
+    message = (message or "").strip()
+    response = (response or "").strip()
+    if not message or not response:
+        return False
+    # Commands (/start, /help) are answered with static texts
+    if message.startswith("/"):
+        return False
+    return not PLACEHOLDER_RESPONSES.match(response)
+
+
+def _text_key(text):
+    return " ".join(text.lower().split())
+
+
+def _epoch(ts):
+    try:
+        return datetime.fromisoformat(ts).timestamp()
+    except (TypeError, ValueError):
+        return time.time()
+
+
+class AnnIndex:
+    def __init__(self, store):
+        self.store = store
+
+    def checkpoint(self):
+        return int(self.store.checkpoint(CHECKPOINT, 0))
+
+    def set_checkpoint(self, row_id):
+        self.store.set_checkpoint(CHECKPOINT, row_id)
+
+    # (doc_id, cosine similarity) of the closest stored document per vector
+    def nearest(self, vectors):
+        found = []
+        for vector in vectors:
+            hits = self.store.similarity_search_by_vector_with_score(vector, k=1)
+            found.append((hits[0][0].id, hits[0][1]) if hits else (None, -1.0))
+        return found
+
+    def add(self, ids, texts, vectors, metadatas, created):
+        self.store.add_embeddings(
+            texts, vectors, metadatas=metadatas, ids=ids, created=created)
+
+    def delete(self, ids):
+        self.store.delete(ids)
+
+    def expire(self, before, max_rows):
+        return self.store.expire(before=before, max_rows=max_rows)
+
+    def compact(self):
+        if not self.store.needs_compaction():
+            return False
+        self.store.compact()
+        return True
+
+    def stats(self):
+        return self.store.stats()
+
+
+class ChromaIndex:
+    def __init__(self, store):
+        self.store = store
+        self.created = {}  # doc_id -> epoch seconds of the conversation row
+
+    def checkpoint(self):
+        return 0  # the in-memory collection starts empty
+
+    def set_checkpoint(self, row_id):
+        pass
+
+    # Chroma ranks by its own distance metric; score the hit by cosine here
+    def nearest(self, vectors):
+        if not self.created:
+            return [(None, -1.0)] * len(vectors)
+        result = self.store._collection.query(
+            query_embeddings=[vector.tolist() for vector in vectors],
+            n_results=1, include=["embeddings"])
+        found = []
+        for vector, ids, embeddings in zip(vectors, result["ids"], result["embeddings"]):
+            if not ids:
+                found.append((None, -1.0))
+                continue
+            stored = np.asarray(embeddings[0], dtype=np.float32)
+            found.append((ids[0], float(vector @ stored / (np.linalg.norm(stored) + 1e-12))))
+        return found
+
+    def add(self, ids, texts, vectors, metadatas, created):
+        self.store._collection.upsert(
+            ids=ids, embeddings=[vector.tolist() for vector in vectors],
+            documents=texts, metadatas=metadatas)
+        self.created.update(zip(ids, created))
+
+    def delete(self, ids):
+        if ids:
+            self.store.delete(ids)
+        for doc_id in ids:
+            self.created.pop(doc_id, None)
+
+    def expire(self, before, max_rows):
+        expired = [doc_id for doc_id, ts in self.created.items()
+                   if before and ts < before]
+        excess = len(self.created) - len(expired) - (max_rows or len(self.created))
+        if excess > 0:
+            remaining = sorted((ts, doc_id) for doc_id, ts in self.created.items()
+                               if not (before and ts < before))
+            expired.extend(doc_id for _, doc_id in remaining[:excess])
+        for start in range(0, len(expired), 1000):
+            self.delete(expired[start:start + 1000])
+        return len(expired)
+
+    # Chroma maintains its HNSW index itself
+    def compact(self):
+        return False
+
+    def stats(self):
+        return {"rows": len(self.created)}
+
+
+class VectorMaintainer:
+    def __init__(self, vectorstore, conversation_store, embeddings, dedup_threshold=0.97,
+                 ttl_days=180, max_docs=200000, batch_size=256):
+        self.vectorstore = vectorstore
+        self.conversation_store = conversation_store
+        self.embeddings = embeddings
+        self.dedup_threshold = dedup_threshold
+        self.ttl_days = ttl_days
+        self.max_docs = max_docs
+        self.batch_size = batch_size
+        self.index = AnnIndex(vectorstore) if isinstance(
+            vectorstore, AnnVectorStore) else ChromaIndex(vectorstore)
+        self.last_row_id = self.index.checkpoint()
+        self.counters = Counter()
+        self.last_run = None
+
+    def _cutoff(self):
+        return time.time() - self.ttl_days * 86400 if self.ttl_days else None
+
+    # Index conversation rows logged since the last call
+    def ingest(self):
+        if not self.last_row_id:
+            return self.backfill()
+        added = 0
+        batch = []
+        last_row_id = self.last_row_id
+        cutoff = self._cutoff()
+        for row in self.conversation_store.iter_rows(after_id=self.last_row_id):
+            last_row_id = row["id"]
+            if not is_indexable(row["message"], row["response"]):
+                self.counters["filtered"] += 1
+                continue
+            if cutoff and _epoch(row["ts"]) < cutoff:
+                self.counters["skipped_stale"] += 1
+                continue
+            batch.append(row)
+            if len(batch) >= self.batch_size:
+                added += self._add(batch)
+                batch = []
+        added += self._add(batch)
+        self.last_row_id = last_row_id
+        self.index.set_checkpoint(last_row_id)
+        self.counters["ingested"] += added
+        return added
+
+    # First load into an empty index: walk the history newest first and stop
+    # at the TTL or once max_docs are indexed, instead of embedding everything
+    # and pruning afterwards
+    def backfill(self):
+        added = 0
+        batch = []
+        newest_id = 0
+        cutoff = self._cutoff()
+        for row in self.conversation_store.iter_rows(newest_first=True):
+            newest_id = newest_id or row["id"]
+            if cutoff and _epoch(row["ts"]) < cutoff:
+                break
+            if not is_indexable(row["message"], row["response"]):
+                self.counters["filtered"] += 1
+                continue
+            batch.append(row)
+            if len(batch) >= self.batch_size or (
+                    self.max_docs and added + len(batch) >= self.max_docs):
+                added += self._add(batch[::-1], backfill=True)
+                batch = []
+                if self.max_docs and added >= self.max_docs:
+                    break
+        added += self._add(batch[::-1], backfill=True)
+        self.last_row_id = newest_id
+        self.index.set_checkpoint(newest_id)
+        self.counters["ingested"] += added
+        return added
+
+    # Index `rows` (oldest first); during a backfill the index holds newer
+    # rows, so a near-duplicate of an indexed document is dropped instead of
+    # replacing it
+    def _add(self, rows, backfill=False):
+        if not rows:
+            return 0
+        # Exact repeats inside the batch: keep the newest row
+        newest = {}
+        for row in rows:
+            newest[_text_key(f"{row['message']}\n{row['response']}")] = row
+        self.counters["duplicates"] += len(rows) - len(newest)
+        rows = list(newest.values())
+        texts = [f"Q: {row['message']}\nA: {row['response']}" for row in rows]
+        vectors = np.asarray(self.embeddings.embed_documents(texts), dtype=np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True) + 1e-12
+        # Near-duplicates inside the batch: walk newest first, keep a row only
+        # if nothing newer already kept is within the threshold
+        similarity = vectors @ vectors.T
+        keep = []
+        for i in reversed(range(len(rows))):
+            if all(similarity[i, j] < self.dedup_threshold for j in keep):
+                keep.append(i)
+        keep.reverse()
+        self.counters["duplicates"] += len(rows) - len(keep)
+        nearest = self.index.nearest(vectors[keep])
+        if backfill:
+            kept = [i for i, (doc_id, score) in zip(keep, nearest)
+                    if not (doc_id and score >= self.dedup_threshold)]
+            self.counters["duplicates"] += len(keep) - len(kept)
+            keep = kept
+            if not keep:
+                return 0
+        else:
+            # Near-duplicates already indexed are older: replace them
+            replaced = [doc_id for doc_id, score in nearest
+                        if doc_id and score >= self.dedup_threshold]
+            if replaced:
+                self.index.delete(replaced)
+                self.counters["duplicates"] += len(replaced)
+        self.index.add(
+            [f"conv-{rows[i]['id']}" for i in keep],
+            [texts[i] for i in keep], vectors[keep],
+            [{"user_id": rows[i]["user_id"], "ts": rows[i]["ts"]} for i in keep],
+            [_epoch(rows[i]["ts"]) for i in keep])
+        return len(keep)
+
+    # Apply TTL and the size cap
+    def prune(self):
+        removed = self.index.expire(self._cutoff(), self.max_docs)
+        self.counters["expired"] += removed
+        return removed
+
+    # One maintenance pass; blocking, run it in a worker thread
+    def run_cycle(self):
+        started = time.monotonic()
+        added = self.ingest()
+        removed = self.prune()
+        compacted = self.index.compact()
+        if compacted:
+            self.counters["compactions"] += 1
+        self.last_run = round(time.monotonic() - started, 2)
+        logging.info(
+            f"Vector maintenance: +{added} documents, -{removed} expired, compacted={compacted} ({self.last_run}s)")
+
+    def stats(self):
+        stats = dict(self.counters)
+        stats["last_run_seconds"] = self.last_run
+        stats.update(self.index.stats())
+        return stats